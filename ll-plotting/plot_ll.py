@@ -36,6 +36,14 @@ of colormaps for a plot. A reference to colormaps can be found at:
 import matplotlib.cm as cm
 from mpl_toolkits.basemap import Basemap
 
+''' The pipeline that reads, draws and saves the plots at the same time lives
+with the MPAS examples, in mpas-patches/mpas_pipeline.py, so we add that
+directory to the places Python looks for modules.
+'''
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'mpas-patches'))
+from mpas_pipeline import run_pipeline, print_pipeline_stats, figure_to_image, save_image
+
 parser = argparse.ArgumentParser()
 parser.add_argument('file',
                     type=str,
@@ -114,13 +122,14 @@ print(grid.variables['pressure'].dimensions)
 
 But, if we just wish to grab the actual values we can do the following:
 
-Pull out all the varibles we desire at the surface level Here we are pulling
-out all the times across the whole domain at level vertical level 0.
+Pull out the varibles we desire. Here we are not reading any values yet, just
+getting hold of the variables. Below, for each time, we will read the values
+across the whole domain at vertical level 0, ie: `pressure[t,:,:,0]`.
 '''
 
-pressure = grid.variables['pressure'][:,:,:,0]
-merdianalWinds = grid.variables['uReconstructMeridional'][:,:,:,0]
-zonalWinds = grid.variables['uReconstructZonal'][:,:,:,0]
+pressure = grid.variables['pressure']
+merdianalWinds = grid.variables['uReconstructMeridional']
+zonalWinds = grid.variables['uReconstructZonal']
 
 # Inspect the shapes of our variables if we want to:
 print('x: ', type(x), x.shape)
@@ -133,9 +142,6 @@ print('merdinalWinds: ', zonalWinds.shape)
 # will be covered with the said vector field.
 downsample_factor = 30
 
-# Convert Pa to KPa
-pressure = pressure / 1000.0 
-
 ''' Create our own color bar if we choose too. We can choose to create the
 upper and the lower limit of what will be colored, with everything above and
 below being set to the highest and lowest colors. By setting the 'extend'
@@ -164,7 +170,21 @@ barb_increments = {'half' : 5,
                    'full' : 10,
                    'flag' : 20}
 
-for t in range(len(time)):
+''' Rather than reading, drawing and saving each time one after the other, we
+run the times through a 'pipeline' (from mpas_pipeline.py). One thread reads
+the values of each time from the file, another draws them and others save
+them, all at the same time, so we are not waiting on the disk while drawing.
+Below are the three functions the pipeline calls for each time.
+'''
+def read_frame(t):
+    # Read the surface level of this time, and convert Pa to KPa
+    return (pressure[t,:,:,0] / 1000.0,
+            merdianalWinds[t,::downsample_factor,::downsample_factor,0],
+            zonalWinds[t,::downsample_factor,::downsample_factor,0])
+
+def render_frame(t, values):
+    surface_pressure, merdianal, zonal = values
+
     fig = plt.figure()
     ax = plt.gca()
 
@@ -189,12 +209,13 @@ for t in range(len(time)):
     print(a[::2])
     >>[1, 3, 5, 7, 9]
     ```
-    i.e. Skip every 2
+    i.e. Skip every 2. The winds were already downsampled when they were read
+    by `read_frame`, so only the values we plot are read from the file.
     '''
     bmap.barbs(x[::downsample_factor, ::downsample_factor],
                y[::downsample_factor, ::downsample_factor],
-               merdianalWinds[t,::downsample_factor,::downsample_factor],
-               zonalWinds[t,::downsample_factor,::downsample_factor],
+               merdianal,
+               zonal,
                pivot='middle',
                length=4,
                zorder=2,
@@ -211,7 +232,7 @@ for t in range(len(time)):
 
     bmap.contourf(x,
                   y,
-                  pressure[t,:,:],
+                  surface_pressure,
                   levels=color_levels,
                   extend='both',
                   cmap=cm.plasma,
@@ -231,7 +252,19 @@ for t in range(len(time)):
     cbar.set_label('Pressure (KPa)')
     cbar.set_ticks(color_ticks)
 
+    # Draw the figure into an image, which is saved by `write_frame`
+    image = figure_to_image(fig)
+    plt.close(fig)
+    return image
 
+def write_frame(t, image):
     filename = 'plot_'+str(t)+'.png'
-    plt.savefig(filename)
-    plt.close()
+    save_image(filename, image, dpi=plt.rcParams['figure.dpi'])
+
+''' Only one thread draws, as MatPlotLib's pyplot can only draw one figure at a
+time. When it is done, it prints how long each stage worked and waited, which
+tells us which stage is the slowest.
+'''
+stats = run_pipeline(range(len(time)), read_frame, render_frame, write_frame,
+                     renderers=1)
+print_pipeline_stats(stats)
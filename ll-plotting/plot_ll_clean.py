@@ -28,6 +28,11 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from mpl_toolkits.basemap import Basemap
 
+# Use the pipeline from mpas-patches/mpas_pipeline.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'mpas-patches'))
+from mpas_pipeline import run_pipeline, print_pipeline_stats, figure_to_image, save_image
+
 parser = argparse.ArgumentParser()
 parser.add_argument('file',
                     type=str,
@@ -66,9 +71,9 @@ lons = list(map(float, lons))
 # coordinate matrices from two our two latitude and longitude array!
 x, y = np.meshgrid(lons, lats)
 
-pressure = grid.variables['pressure'][:,:,:,0]
-merdianalWinds = grid.variables['uReconstructMeridional'][:,:,:,0]
-zonalWinds = grid.variables['uReconstructZonal'][:,:,:,0]
+pressure = grid.variables['pressure']
+merdianalWinds = grid.variables['uReconstructMeridional']
+zonalWinds = grid.variables['uReconstructZonal']
 
 # When plotting a vector field, (ie barbs, quiver, or streamline), we'll need
 # to downsample how many data values we actually plot. If not, we will the plot
@@ -83,9 +88,6 @@ print('merdinalWinds: ', zonalWinds.shape)
 
 
 
-# Convert Pa to KPa
-pressure = pressure / 1000.0 
-
 # Choose the amount of color levels we want, and the range of pressure we want
 # to display on the plot
 MAX_PRESSURE = 100.0
@@ -101,9 +103,16 @@ barb_increments = {'half' : 5,
                    'flag' : 20}
 
 
-# Loop through all of the times and create a plot of surface pressure and
-# surface winds for each.
-for t in range(len(time)):
+# Read, draw and save the plot of each time at the same time with a pipeline
+def read_frame(t):
+    # Read the surface level of this time, and convert Pa to KPa
+    return (pressure[t,:,:,0] / 1000.0,
+            merdianalWinds[t,::downsample_factor,::downsample_factor,0],
+            zonalWinds[t,::downsample_factor,::downsample_factor,0])
+
+def render_frame(t, values):
+    surface_pressure, merdianal, zonal = values
+
     fig = plt.figure()
     ax = plt.gca()
 
@@ -124,8 +133,8 @@ for t in range(len(time)):
     # of them
     bmap.barbs(x[::downsample_factor, ::downsample_factor],
                y[::downsample_factor, ::downsample_factor],
-               merdianalWinds[t,::downsample_factor,::downsample_factor],
-               zonalWinds[t,::downsample_factor,::downsample_factor],
+               merdianal,
+               zonal,
                pivot='middle',
                length=4,
                zorder=2,
@@ -134,7 +143,7 @@ for t in range(len(time)):
 
     bmap.contourf(x,
                   y,
-                  pressure[t,:,:],
+                  surface_pressure,
                   levels=color_levels,
                   extend='both',
                   cmap=cm.plasma,
@@ -144,6 +153,14 @@ for t in range(len(time)):
     cbar.set_label('Pressure (KPa)')
     cbar.set_ticks(color_ticks)
 
+    image = figure_to_image(fig)
+    plt.close(fig)
+    return image
+
+def write_frame(t, image):
     filename = 'plot_'+str(t)+'.png'
-    plt.savefig(filename)
-    plt.close()
+    save_image(filename, image, dpi=plt.rcParams['figure.dpi'])
+
+stats = run_pipeline(range(len(time)), read_frame, render_frame, write_frame,
+                     renderers=1)
+print_pipeline_stats(stats)
@@ -0,0 +1,187 @@
+import os
+import sys
+import pickle as pkle
+
+import numpy as np
+
+''' This module finds the MPAS grid cells that lie along a cross-section path
+and reads the values of a field on those cells.
+
+A path is given as two or more latitude, longitude points which are joined by
+great circle arcs. `get_cross_section_path` samples points along these arcs
+and, starting from the first point, walks the mesh (using `cellsOnCell`) from
+cell to neighbouring cell to find the cell that contains each point. Because
+each walk starts from the cell found for the previous point, only a handful of
+cells are checked for each point.
+
+Like `get_mpas_patches`, the path that is found is saved (using Python's Pickle
+module) as a 'section' file, so it only needs to be found once for a mesh.
+
+Once we have the cells, `read_cells` will read a field at only those cells.
+MPAS fields are stored as (Time, nCells, nVertLevels), so all the levels of a
+cell are next to each other on disk. `read_cells` groups the cells into runs of
+neighbouring cell indices and reads each run, at all levels, in one read.
+
+'''
+
+EARTH_RADIUS = 6371.229 # km, the sphere radius used by MPAS
+
+def lat_lon_to_xyz(lat, lon):
+    ''' Convert latitudes and longitudes (in radians) to unit vectors '''
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    return np.stack((np.cos(lat) * np.cos(lon),
+                     np.cos(lat) * np.sin(lon),
+                     np.sin(lat)), axis=-1)
+
+def great_circle_points(lats, lons, spacing):
+    ''' Sample points (unit vectors) along the great circle arcs joining each
+    of the lats, lons points (in degrees), with about `spacing` radians between
+    each point. The distance of each point along the path (in radians) is also
+    returned.
+    '''
+    ends = lat_lon_to_xyz(np.radians(lats), np.radians(lons))
+
+    points = [ends[0:1]]
+    distance = [np.zeros(1)]
+    total = 0.0
+    for a, b in zip(ends[:-1], ends[1:]):
+        angle = np.arccos(np.clip(np.dot(a, b), -1.0, 1.0))
+        n = max(int(np.ceil(angle / spacing)), 1)
+        f = np.arange(1, n + 1) / n
+
+        # Spherical linear interpolation between the two end points
+        if angle > 0.0:
+            wa = np.sin((1.0 - f) * angle) / np.sin(angle)
+            wb = np.sin(f * angle) / np.sin(angle)
+        else:
+            wa = 1.0 - f
+            wb = f
+        points.append(wa[:,np.newaxis] * a + wb[:,np.newaxis] * b)
+        distance.append(total + f * angle)
+        total += angle
+
+    return np.concatenate(points), np.concatenate(distance)
+
+def find_nearest_cell(point, cellXYZ, cellsOnCell, nEdgesOnCell, start=0):
+    ''' Walk the mesh from the cell `start` to the cell whose center is
+    closest to `point` (a unit vector). cellsOnCell is zero based here.
+
+    On a Voronoi mesh if a point is not within a cell, then one of the cell's
+    neighbours is closer to it, so we can keep stepping to the closest
+    neighbour until there is none closer.
+    '''
+    cell = start
+    closest = np.dot(cellXYZ[cell], point)
+    while True:
+        neighbours = cellsOnCell[cell,:nEdgesOnCell[cell]]
+        neighbours = neighbours[neighbours >= 0]
+        if neighbours.size == 0:
+            return cell
+        dots = np.dot(cellXYZ[neighbours], point)
+        best = np.argmax(dots)
+        if dots[best] <= closest:
+            return cell
+        cell = neighbours[best]
+        closest = dots[best]
+
+def read_mesh_cells(mesh):
+    ''' Read the cell locations and cell connectivity of a mesh in one read
+    each, returning cellXYZ and a zero based cellsOnCell.
+    '''
+    latCell = mesh.variables['latCell'][:]
+    lonCell = mesh.variables['lonCell'][:]
+    cellsOnCell = np.array(mesh.variables['cellsOnCell'][:], dtype=np.int64) - 1
+    nEdgesOnCell = np.array(mesh.variables['nEdgesOnCell'][:], dtype=np.int64)
+
+    return lat_lon_to_xyz(latCell, lonCell), cellsOnCell, nEdgesOnCell
+
+def get_cross_section_path(mesh, lats, lons, pickle=True, pickleFile=None):
+    ''' Find the ordered cells along the path through the points lats, lons
+    (in degrees). Returns a dictionary containing:
+
+    * 'cells'    - The (zero based) cell indices along the path
+    * 'distance' - The distance (km) along the path of each of these cells
+    * 'lats', 'lons' - The points of the path
+    '''
+    nCells = len(mesh.dimensions['nCells'])
+
+    if pickleFile:
+        pickle_fname = pickleFile
+    else:
+        pickle_fname = mesh.config_block_decomp_file_prefix.split('/')[-1]
+        pickle_fname = pickle_fname.split('.')[0]
+        points = '_'.join(['{0:g}_{1:g}'.format(lat, lon)
+                           for lat, lon in zip(lats, lons)])
+        pickle_fname = pickle_fname+'.'+str(nCells)+'.'+points+'.'+'section'
+
+    if pickle and os.path.isfile(pickle_fname):
+        pickled_path = open(pickle_fname, 'rb')
+        try:
+            section = pkle.load(pickled_path)
+            pickled_path.close()
+            print("Section file (", pickle_fname, ") loaded succsfully")
+            return section
+        except:
+            print("ERROR: Error while trying to read the pickled section")
+            print("ERROR: The section file may be corrupted or was not created")
+            print("ERROR: succesfully!")
+            sys.exit(-1)
+
+    cellXYZ, cellsOnCell, nEdgesOnCell = read_mesh_cells(mesh)
+
+    # Sample the path at a quarter of the mean cell spacing so that we will not
+    # step over any cells along the way
+    spacing = 0.25 * np.sqrt(4.0 * np.pi / nCells)
+    points, distance = great_circle_points(lats, lons, spacing)
+
+    # Find the first cell by checking every cell, then walk from there
+    cell = np.argmax(np.dot(cellXYZ, points[0]))
+    path_cells = np.empty(len(points), dtype=np.int64)
+    for i, point in enumerate(points):
+        cell = find_nearest_cell(point, cellXYZ, cellsOnCell, nEdgesOnCell,
+                                 start=cell)
+        path_cells[i] = cell
+
+    # Several points will fall within the same cell, keep each cell once and
+    # place it at the middle of the points that fell within it
+    starts = np.concatenate(([0], np.where(np.diff(path_cells) != 0)[0] + 1))
+    counts = np.diff(np.append(starts, len(path_cells)))
+    cells = path_cells[starts]
+    cell_distance = np.add.reduceat(distance, starts) / counts
+
+    section = {'cells' : cells,
+               'distance' : cell_distance * EARTH_RADIUS,
+               'lats' : np.asarray(lats),
+               'lons' : np.asarray(lons)}
+
+    if pickle:
+        pickle_file = open(pickle_fname, 'wb')
+        pkle.dump(section, pickle_file)
+        pickle_file.close()
+        print("Created a section file for mesh: ", pickle_fname)
+
+    return section
+
+def read_cells(var, t, cells, maxGap=16):
+    ''' Read the variable `var` at time `t` for the (zero based) cells
+    `cells`, returning an array of shape (len(cells), ...). If `t` is None
+    then `var` is taken to not have a Time dimension (ie: zgrid).
+
+    The cells are sorted and grouped into runs, where cells in a run are no
+    more than maxGap cells apart. Each run is read, at all levels, in a single
+    read as reading a few extra cells is much faster than making another read.
+    '''
+    cells = np.asarray(cells)
+    unique_cells, inverse = np.unique(cells, return_inverse=True)
+
+    breaks = np.where(np.diff(unique_cells) > maxGap + 1)[0] + 1
+    values = []
+    for run in np.split(unique_cells, breaks):
+        if t is None:
+            block = var[run[0]:run[-1]+1]
+        else:
+            block = var[t,run[0]:run[-1]+1]
+        values.append(block[run - run[0]])
+
+    return np.concatenate(values)[inverse]
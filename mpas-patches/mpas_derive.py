@@ -0,0 +1,283 @@
+import ast
+
+import numpy as np
+
+''' This module evaluates derived quantities, given as simple Python
+expressions of the variables of an MPAS file, at one time and level.
+
+For example, wind speed can be plotted with:
+
+    speed = Derivation(mesh, 'hypot(uReconstructZonal, uReconstructMeridional)')
+    patch_collection.set_array(speed.evaluate(t, l))
+
+A variable name followed by a level, ie: `theta[10] - theta[0]`, reads that
+variable at that model level rather than the level being plotted. If a
+`reader` is given (ie: to read pressure levels), it is only used for the
+variables without a level; variables with a level are always read at that
+model level.
+
+Only the slabs (ie: `var[t,:,l]`) of the variables an expression uses are
+read. Each operation writes into an output array that is kept by the
+`Derivation`, so no new arrays are created for each plot. If a dictionary is
+given as `cache` to `evaluate`, then the slabs that are read and the results of
+each part of the expression are kept in it, so that other expressions which use
+the same variables or parts can use them rather than reading or computing them
+again. A new (or cleared) cache should be used for each time and level.
+
+If the numexpr module is installed, `useNumexpr=True` will evaluate
+expressions which only use the functions numexpr supports with numexpr.
+
+'''
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+FUNCTIONS = {'abs' : np.absolute,
+             'sqrt' : np.sqrt,
+             'exp' : np.exp,
+             'log' : np.log,
+             'log10' : np.log10,
+             'sin' : np.sin,
+             'cos' : np.cos,
+             'tan' : np.tan,
+             'arctan2' : np.arctan2,
+             'hypot' : np.hypot,
+             'maximum' : np.maximum,
+             'minimum' : np.minimum}
+
+NUMEXPR_FUNCTIONS = ['abs', 'sqrt', 'exp', 'log', 'log10', 'sin', 'cos',
+                     'tan', 'arctan2']
+
+OPERATORS = {ast.Add : np.add,
+             ast.Sub : np.subtract,
+             ast.Mult : np.multiply,
+             ast.Div : np.true_divide,
+             ast.Pow : np.power}
+
+UNARY_OPERATORS = {ast.USub : np.negative,
+                   ast.UAdd : np.positive}
+
+def read_slab(mesh, name, t, l):
+    ''' Read the variable `name` at time t and level l. Variables without a
+    vertical dimension (ie: surface fields) are read at time t.
+    '''
+    var = mesh.variables[name]
+    if len(var.dimensions) > 2:
+        return var[t,...,l]
+    return var[t,...]
+
+class Derivation(object):
+    ''' A derived quantity of the variables within `mesh` '''
+
+    def __init__(self, mesh, expression, useNumexpr=False, reader=None):
+        self.mesh = mesh
+        self.expression = expression
+        self.reader = reader
+        self.variables = set()
+        self.slab_variables = set() # Variables read at the level being plotted
+        self.buffers = {}
+
+        try:
+            self.tree = ast.parse(expression.strip(), mode='eval').body
+        except SyntaxError:
+            raise ValueError("Could not understand the expression: "+expression)
+
+        self._check(self.tree)
+        if not self.variables:
+            raise ValueError("The expression does not use any variables: "+expression)
+
+        self.numexpr_expression = None
+        if useNumexpr and numexpr is not None and self._numexpr_supported(self.tree):
+            self.numexpr_expression = ast.unparse(_LeafRenamer().visit(
+                                                  ast.parse(expression.strip(),
+                                                            mode='eval')))
+
+    def _check(self, node):
+        ''' Check that the expression only uses variables within the mesh and
+        the functions and operators we know of.
+        '''
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return
+        if isinstance(node, ast.Name):
+            if node.id not in self.mesh.variables.keys():
+                raise ValueError("The variable "+node.id+" was not found in this mpas mesh!")
+            self.variables.add(node.id)
+            self.slab_variables.add(node.id)
+            return
+        if isinstance(node, ast.Subscript):
+            level = _level(node)
+            if level is None:
+                raise ValueError("Only a single level can be chosen, ie: theta[0]")
+            name = node.value.id
+            if name not in self.mesh.variables.keys():
+                raise ValueError("The variable "+name+" was not found in this mpas mesh!")
+            shape = self.mesh.variables[name].shape
+            if len(shape) > 2 and not 0 <= level < shape[-1]:
+                raise ValueError("The variable "+name+" does not have a level "+str(level))
+            self.variables.add(name)
+            return
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            self._check(node.left)
+            self._check(node.right)
+            return
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            self._check(node.operand)
+            return
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                raise ValueError("Unknown function in expression: "+ast.unparse(node.func))
+            if node.keywords:
+                raise ValueError("Functions can not be given keyword arguments")
+            nin = FUNCTIONS[node.func.id].nin
+            if len(node.args) != nin:
+                raise ValueError("The function "+node.func.id+" takes "+str(nin)+
+                                 " argument(s), not "+str(len(node.args)))
+            for arg in node.args:
+                self._check(arg)
+            return
+        raise ValueError("Could not understand the expression: "+ast.unparse(node))
+
+    def _numexpr_supported(self, node):
+        for child in ast.walk(node):
+            if isinstance(child, ast.Call) and child.func.id not in NUMEXPR_FUNCTIONS:
+                return False
+        return True
+
+    def _read(self, name, t, l, cache, modelLevel=False):
+        ''' Read `name` at time t and level l, with the reader if we have one.
+        If modelLevel is True, l is a model level, which is read from the mesh.
+        '''
+        reader = None if modelLevel else self.reader
+        key = ('slab', name, t, l, reader is not None)
+        if key in cache:
+            return cache[key]
+
+        if reader:
+            slab = reader(name, t, l)
+        else:
+            slab = read_slab(self.mesh, name, t, l)
+        slab = np.ma.getdata(slab)
+
+        cache[key] = slab
+        return slab
+
+    def _buffer(self, node, args, out=None):
+        ''' The output array for `node`, which is kept between evaluations '''
+        dtype = np.result_type(*args)
+        if dtype.kind in 'biu':
+            dtype = np.float64
+        shape = np.broadcast_shapes(*[np.shape(arg) for arg in args])
+
+        if out is not None:
+            return out
+
+        buffer = self.buffers.get(id(node))
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[id(node)] = buffer
+        return buffer
+
+    def _evaluate(self, node, t, l, cache):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self._read(node.id, t, l, cache)
+        if isinstance(node, ast.Subscript):
+            return self._read(node.value.id, t, _level(node), cache, modelLevel=True)
+
+        # Parts of the expression without variables (ie: 2*3) are worked out as
+        # Python floats, so they do not change the dtype of the result
+        constant = _constant(node)
+        if constant is not None:
+            return constant
+
+        key = ('expression', t, l, ast.dump(node))
+        if key in cache:
+            return cache[key]
+
+        if isinstance(node, ast.BinOp):
+            function = OPERATORS[type(node.op)]
+            args = [self._evaluate(node.left, t, l, cache),
+                    self._evaluate(node.right, t, l, cache)]
+        elif isinstance(node, ast.UnaryOp):
+            function = UNARY_OPERATORS[type(node.op)]
+            args = [self._evaluate(node.operand, t, l, cache)]
+        else:
+            function = FUNCTIONS[node.func.id]
+            args = [self._evaluate(arg, t, l, cache) for arg in node.args]
+
+        result = function(*args, out=self._buffer(node, args))
+        cache[key] = result
+        return result
+
+    def evaluate(self, t, l, cache=None, out=None):
+        ''' Evaluate the expression at time t and level l. The result is
+        written into `out` if it is given. Otherwise the returned array will be
+        overwritten by the next call to evaluate.
+        '''
+        if cache is None:
+            cache = {}
+
+        if self.numexpr_expression:
+            leaves = {}
+            for node in ast.walk(self.tree):
+                if isinstance(node, ast.Name) and node.id in self.slab_variables:
+                    leaves[node.id] = self._read(node.id, t, l, cache)
+                elif isinstance(node, ast.Subscript):
+                    leaves[_leaf_name(node)] = self._read(node.value.id, t,
+                                                          _level(node), cache,
+                                                          modelLevel=True)
+            args = list(leaves.values())
+            return numexpr.evaluate(self.numexpr_expression,
+                                    local_dict=leaves,
+                                    out=self._buffer(self.tree, args, out),
+                                    casting='unsafe')
+
+        # The result is kept in the cache, so copy it into `out` rather than
+        # evaluating into `out`, which the caller may change
+        result = self._evaluate(self.tree, t, l, cache)
+        if out is not None:
+            out[...] = result
+            return out
+        return result
+
+def _level(node):
+    ''' The level chosen by the subscript `node`, ie: 0 for theta[0] '''
+    index = node.slice
+    if (isinstance(node.value, ast.Name) and isinstance(index, ast.Constant)
+            and isinstance(index.value, int)):
+        return index.value
+    return None
+
+def _constant(node):
+    ''' The value of `node` as a Python float if it does not use any
+    variables (ie: 2*3), otherwise None
+    '''
+    if isinstance(node, ast.Constant):
+        return float(node.value)
+    if isinstance(node, ast.BinOp):
+        args = [_constant(node.left), _constant(node.right)]
+        function = OPERATORS[type(node.op)]
+    elif isinstance(node, ast.UnaryOp):
+        args = [_constant(node.operand)]
+        function = UNARY_OPERATORS[type(node.op)]
+    elif isinstance(node, ast.Call):
+        args = [_constant(arg) for arg in node.args]
+        function = FUNCTIONS[node.func.id]
+    else:
+        return None
+
+    if any(arg is None for arg in args):
+        return None
+    return float(function(*args))
+
+def _leaf_name(node):
+    return node.value.id+'__'+str(_level(node))
+
+class _LeafRenamer(ast.NodeTransformer):
+    ''' Replace theta[0] with theta__0 so the expression can be given to numexpr '''
+
+    def visit_Subscript(self, node):
+        return ast.copy_location(ast.Name(id=_leaf_name(node), ctx=ast.Load()), node)
@@ -0,0 +1,82 @@
+'''
+File - mpas_extract_stations.py
+
+This python file provides an example of extracting MPAS fields at a list of
+station locations, for every time in an MPAS history file, without reading
+the whole field.
+
+The stations are read from a CSV file with the columns name, lat and lon:
+
+    name,lat,lon
+    BOU,40.01,-105.25
+    DEN,39.86,-104.67
+
+The closest cell to each station is found by `get_station_cells` within the
+`mpas_stations.py` module, which saves the cells it finds to a 'stations' file
+so that they only need to be found once. For each time and variable only the
+station cells are read, and written to a NetCDF file with the dimensions
+(Time, nStations, nVertLevels).
+
+Run this script by running:
+
+    python mpas_extract_stations.py /path/to/history-file.nc stations.csv -v theta pressure
+
+'''
+
+import os
+import sys
+import argparse
+
+from mpas_stations import read_stations, get_station_cells, extract_stations
+from mpas_store import open_mpas, is_store
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('file',
+                    type=str,
+                    help='''File (or store) you want to extract from''')
+parser.add_argument('stations',
+                    type=str,
+                    help='''CSV file of the stations (name,lat,lon)''')
+parser.add_argument('-v',
+                    '--var',
+                    type=str,
+                    nargs='+',
+                    default=['pressure'],
+                    help='''Variables you want to extract from that file''')
+parser.add_argument('-o',
+                    '--output',
+                    type=str,
+                    default='stations.nc',
+                    help='''The NetCDF file to write the station values to''')
+
+args = parser.parse_args()
+file = args.file
+
+if not os.path.isfile(file) and not is_store(file):
+    print("That file was not found :(")
+    sys.exit(-1)
+
+if not os.path.isfile(args.stations):
+    print("That stations file was not found :(")
+    sys.exit(-1)
+
+mesh = open_mpas(file)
+
+for variable in args.var:
+    if variable not in mesh.variables.keys():
+        print("The variable", variable, "was not found in this mpas mesh!")
+        sys.exit(-1)
+    if mesh.variables[variable].dimensions[:2] != ('Time', 'nCells'):
+        print("The variable", variable, "is not a (Time, nCells, ...) variable")
+        sys.exit(-1)
+
+try:
+    names, lats, lons = read_stations(args.stations)
+except ValueError as e:
+    print(e)
+    sys.exit(-1)
+cells = get_station_cells(mesh, lats, lons)
+
+extract_stations(mesh, args.var, names, lats, lons, cells, args.output)
+print("Wrote ", len(cells), " stations to ", args.output)
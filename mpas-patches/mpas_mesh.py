@@ -0,0 +1,148 @@
+import os
+import sys
+
+import numpy as np
+from netCDF4 import Dataset
+
+''' This module reads the mesh of an MPAS run from its static or grid file,
+rather than from a history file.
+
+History files hold many large fields, and opening them just to read the mesh
+is wasteful. `load_mesh_geometry` reads only the mesh variables that the
+plotting modules use, each in a single read, and saves them to a 'geometry'
+file (a Numpy .npz file). Later runs load the geometry file instead of reading
+the static file again.
+
+The `MeshGeometry` it returns has `dimensions` and `variables` like a NetCDF4
+Dataset, so it can be given as the `mesh` to `get_mpas_patches`,
+`get_mpas_triangulation`, `get_mpas_patch_arrays`, `get_cross_section_path`
+and `get_station_cells`.
+
+`check_mesh` compares only the dimensions in the header of a history file to
+the geometry, to make sure the history file is on the same mesh, without
+reading any of the history file's mesh variables.
+
+'''
+
+MESH_VARIABLES = ['latCell',
+                  'lonCell',
+                  'latVertex',
+                  'lonVertex',
+                  'nEdgesOnCell',
+                  'verticesOnCell',
+                  'cellsOnCell',
+                  'cellsOnVertex']
+
+OPTIONAL_MESH_VARIABLES = ['zgrid']
+
+MESH_DIMENSIONS = ['nCells',
+                   'nVertices',
+                   'maxEdges',
+                   'vertexDegree',
+                   'nVertLevels',
+                   'nVertLevelsP1']
+
+class MeshDimension(object):
+    ''' A dimension of a `MeshGeometry`, which, like a NetCDF4 Dimension, gives
+    its size with len()
+    '''
+    def __init__(self, size):
+        self.size = int(size)
+
+    def __len__(self):
+        return self.size
+
+class MeshGeometry(object):
+    ''' The mesh variables of an MPAS mesh, held as Numpy arrays '''
+
+    def __init__(self, dimensions, variables, config_block_decomp_file_prefix):
+        self.dimensions = {name : MeshDimension(size)
+                           for name, size in dimensions.items()}
+        self.variables = variables
+        self.config_block_decomp_file_prefix = config_block_decomp_file_prefix
+
+def load_mesh_geometry(meshFile, cache=True, cacheFile=None):
+    ''' Read the mesh variables of the static or grid file meshFile, or load
+    them from its geometry file if it has one.
+    '''
+    mesh = Dataset(meshFile, 'r')
+    mesh.set_auto_mask(False)
+    nCells = len(mesh.dimensions['nCells'])
+
+    if 'config_block_decomp_file_prefix' in mesh.ncattrs():
+        prefix = mesh.config_block_decomp_file_prefix
+    else:
+        prefix = os.path.basename(meshFile)
+
+    if cacheFile:
+        cache_fname = cacheFile
+    else:
+        cache_fname = prefix.split('/')[-1]
+        cache_fname = cache_fname.split('.')[0]
+        cache_fname = cache_fname+'.'+str(nCells)+'.'+'geometry.npz'
+
+    if cache and os.path.isfile(cache_fname):
+        mesh.close()
+        try:
+            geometry = read_geometry_file(cache_fname, prefix)
+            print("Geometry file (", cache_fname, ") loaded succsfully")
+            return geometry
+        except:
+            print("ERROR: Error while trying to read the geometry file")
+            print("ERROR: The geometry file may be corrupted or was not created")
+            print("ERROR: succesfully!")
+            sys.exit(-1)
+
+    for name in MESH_VARIABLES:
+        if name not in mesh.variables.keys():
+            print("ERROR: The variable", name, "was not found in", meshFile)
+            sys.exit(-1)
+
+    dimensions = {name : len(mesh.dimensions[name]) for name in MESH_DIMENSIONS
+                  if name in mesh.dimensions}
+
+    # Read each variable whole, in one read
+    variables = {}
+    for name in MESH_VARIABLES + OPTIONAL_MESH_VARIABLES:
+        if name in mesh.variables.keys():
+            variables[name] = mesh.variables[name][:]
+    mesh.close()
+
+    geometry = MeshGeometry(dimensions, variables, prefix)
+    if cache:
+        write_geometry_file(cache_fname, geometry)
+        print("Created a geometry file for mesh: ", cache_fname)
+
+    return geometry
+
+def write_geometry_file(geometryFile, geometry):
+    ''' Save the variables and dimensions of `geometry` to geometryFile '''
+    arrays = dict(geometry.variables)
+    for name, dimension in geometry.dimensions.items():
+        arrays['dim_'+name] = np.array(len(dimension))
+    np.savez(geometryFile, **arrays)
+
+def read_geometry_file(geometryFile, config_block_decomp_file_prefix):
+    ''' Load a MeshGeometry from a geometry file written by
+    `write_geometry_file`
+    '''
+    with np.load(geometryFile) as geometry:
+        dimensions = {name[4:] : int(geometry[name]) for name in geometry.files
+                      if name.startswith('dim_')}
+        variables = {name : geometry[name] for name in geometry.files
+                     if not name.startswith('dim_')}
+    return MeshGeometry(dimensions, variables, config_block_decomp_file_prefix)
+
+def check_mesh(history, geometry):
+    ''' Check the dimensions of the history file `history` (an open Dataset)
+    match those of the geometry. Raises a ValueError if they do not.
+    '''
+    if 'nCells' not in history.dimensions:
+        raise ValueError("The history file does not have any cells (nCells)")
+
+    for name, dimension in geometry.dimensions.items():
+        if name in history.dimensions and len(history.dimensions[name]) != len(dimension):
+            raise ValueError("The history file's "+name+" ("
+                             +str(len(history.dimensions[name]))
+                             +") does not match the mesh's ("
+                             +str(len(dimension))+")")
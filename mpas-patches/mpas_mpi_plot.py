@@ -0,0 +1,359 @@
+'''
+File - mpas_mpi_plot.py
+
+This python file provides an example of spreading the plots of many MPAS
+history files (ie: the members of an ensemble) across many processes, and many
+nodes, with MPI (using the mpi4py module).
+
+Each file, variable, time and level to plot is a 'frame'. The frames are split
+across the MPI ranks, and each rank saves its own plots. When every rank has
+finished, rank 0 writes a 'manifest' (a JSON file) listing every plot that was
+created, by which rank and how long it took.
+
+Creating the MPAS polygons is slow, so only rank 0 reads them from the mesh,
+with `get_mpas_patch_arrays`. If given a static or grid file (with -m), rank 0
+reads the mesh from it, or from its geometry file, with `load_mesh_geometry`,
+and checks every file is on that mesh with `check_mesh`. The polygons are then
+sent to every other rank as plain Numpy arrays (with MPI's Bcast), rather than
+every rank reading them. All of the MPAS files are taken to be on the same
+mesh.
+
+Files on a latitude, longitude grid (ie: from convert_mpas) can be plotted as
+well, and are plotted as filled contours as in ll-plotting/plot_ll.py.
+
+Frames can be split between the ranks 'statically', where each rank plots
+every size'th frame, or 'dynamically', where rank 0 hands out frames one at a
+time to the other ranks as they finish their last one. Dynamic scheduling is
+best when some frames take much longer than others.
+
+Run this script by running:
+
+    mpirun -n 4 python mpas_mpi_plot.py /path/to/member*/history-file.nc -v theta pressure -l 0 10
+
+MPAS stores (see mpas_store.py) can be given in place of MPAS history files.
+
+Without mpi4py installed this script runs all the frames itself.
+
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import traceback
+
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.cm as cm
+from mpl_toolkits.basemap import Basemap
+
+from mpas_patches import get_mpas_patch_arrays, get_mpas_polygons
+from mpas_derive import Derivation
+from mpas_mesh import load_mesh_geometry, check_mesh
+from mpas_store import open_mpas, is_store
+
+try:
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+except ImportError:
+    MPI = None
+    comm = None
+    rank = 0
+    size = 1
+
+READY_TAG = 1
+FRAME_TAG = 2
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('files',
+                    type=str,
+                    nargs='+',
+                    help='''Files (or stores) you want to plot from''')
+parser.add_argument('-v',
+                    '--var',
+                    type=str,
+                    nargs='+',
+                    default=['pressure'],
+                    help='''Variables (or expressions of them) you want to plot''')
+parser.add_argument('-l',
+                    '--levels',
+                    type=int,
+                    nargs='+',
+                    default=[0],
+                    help='''Vertical levels you want to plot''')
+parser.add_argument('-s',
+                    '--schedule',
+                    choices=['static', 'dynamic'],
+                    default='static',
+                    help='''How the frames are split across the ranks''')
+parser.add_argument('-m',
+                    '--mesh',
+                    type=str,
+                    help='''Static or grid file to read the mesh from, rather
+                    than the first file''')
+parser.add_argument('-o',
+                    '--output',
+                    type=str,
+                    default='.',
+                    help='''Directory to save the plots and manifest to''')
+
+args = parser.parse_args()
+
+# A file or variable given twice would only plot the same frames twice
+args.files = list(dict.fromkeys(args.files))
+args.var = list(dict.fromkeys(args.var))
+
+for file in args.files:
+    if not os.path.isfile(file) and not is_store(file):
+        print("The file", file, "was not found :(")
+        sys.exit(-1)
+
+os.makedirs(args.output, exist_ok=True)
+
+''' Each rank keeps the files it has opened, and the `Derivation` of each
+variable, so that they are only opened once no matter how many frames of a
+file the rank plots.
+'''
+datasets = {}
+derived = {}
+
+def get_derivation(file, variable):
+    if file not in datasets:
+        datasets[file] = open_mpas(file)
+    if (file, variable) not in derived:
+        derived[(file, variable)] = Derivation(datasets[file], variable)
+    return derived[(file, variable)]
+
+''' Rank 0 checks every variable (or expression) can be made from every file
+before any plots are made, and tells the other ranks if one can not, so that
+every rank stops rather than one rank failing part way through while the
+others wait for it.
+'''
+error = None
+if rank == 0:
+    for file in args.files:
+        for variable in args.var:
+            try:
+                get_derivation(file, variable)
+            except ValueError as e:
+                error = file+": "+str(e)
+                break
+        if error:
+            break
+
+if comm:
+    error = comm.bcast(error, root=0)
+if error:
+    if rank == 0:
+        print(error)
+    sys.exit(-1)
+
+''' Every rank needs to know the frames, and each rank works them out for
+itself in the same order. Only the first file's header is read to find the
+number of times, so all the files should have the same number of times.
+'''
+first = open_mpas(args.files[0])
+nTimes = len(first.dimensions['Time'])
+mpas = 'nCells' in first.dimensions
+first.close()
+
+''' The name of each file and variable's plots. Ensemble members are often
+files with the same name in different directories, so the file's path is used
+in the name. Different files or expressions can still give the same name (for
+example theta*2 and theta/2 are both theta_2), so those also get the index of
+the file and of the variable added, so that no plot overwrites another.
+'''
+plot_names = {}
+for f, file in enumerate(args.files):
+    for v, variable in enumerate(args.var):
+        plot_names[(file, variable)] = re.sub('[^A-Za-z0-9]+', '_',
+                                              os.path.splitext(file)[0]+'_'+variable).strip('_')
+names = list(plot_names.values())
+for f, file in enumerate(args.files):
+    for v, variable in enumerate(args.var):
+        if names.count(plot_names[(file, variable)]) > 1:
+            plot_names[(file, variable)] += '_'+str(f)+'_'+str(v)
+
+frames = [(file, variable, t, l) for file in args.files
+                                 for variable in args.var
+                                 for t in range(nTimes)
+                                 for l in args.levels]
+
+''' Rank 0 reads the polygons of the mesh and sends them to every other rank.
+We first send the shape of the arrays (a small Python object, with `bcast`) so
+each rank can make room for the arrays, then the arrays themselves (with
+`Bcast`, which sends the raw array data). If a file is not on the mesh given
+with -m, rank 0 sends the error instead, and every rank stops.
+'''
+polygons = None
+if mpas:
+    error = None
+    shape = None
+    if rank == 0:
+        if args.mesh:
+            geometry = load_mesh_geometry(args.mesh)
+            for file in args.files:
+                try:
+                    check_mesh(datasets[file], geometry)
+                except ValueError as e:
+                    error = file+": "+str(e)
+                    break
+        else:
+            geometry = open_mpas(args.files[0])
+
+        if not error:
+            vertices, nEdgesOnCell = get_mpas_patch_arrays(geometry)
+            vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+            nEdgesOnCell = np.ascontiguousarray(nEdgesOnCell, dtype=np.int32)
+            shape = vertices.shape
+        if not args.mesh:
+            geometry.close()
+
+    if comm:
+        error, shape = comm.bcast((error, shape), root=0)
+    if error:
+        if rank == 0:
+            print(error)
+        sys.exit(-1)
+
+    if comm:
+        if rank != 0:
+            vertices = np.empty(shape, dtype=np.float64)
+            nEdgesOnCell = np.empty(shape[0], dtype=np.int32)
+        comm.Bcast(vertices, root=0)
+        comm.Bcast(nEdgesOnCell, root=0)
+
+    polygons = get_mpas_polygons(vertices, nEdgesOnCell)
+
+bmap = Basemap(projection='cyl',
+               llcrnrlat=-90,
+               urcrnrlat=90,
+               llcrnrlon=-180,
+               urcrnrlon=180,
+               resolution='l')
+
+def plot_frame(frame):
+    file, variable, t, l = frame
+
+    values = get_derivation(file, variable).evaluate(t, l)
+
+    fig = plt.figure()
+    ax = plt.gca()
+
+    bmap.drawcoastlines()
+    bmap.drawparallels(range(-90, 90, 30),
+                       linewidth=1,
+                       labels=[1,0,0,0],
+                       color='b')
+    bmap.drawmeridians(range(-180, 180, 45),
+                       linewidth=1,
+                       labels=[0,0,0,1],
+                       color='b',
+                       rotation=45)
+
+    if polygons is not None:
+        polygons.set_array(values)
+        polygons.autoscale()
+        polygons.set_edgecolors('none')
+        polygons.set_antialiaseds(False)
+        polygons.set_cmap(cm.gist_ncar)
+        ax.add_collection(polygons)
+        plot = polygons
+    else:
+        lats = datasets[file].variables['latitude'][:]
+        lons = datasets[file].variables['longitude'][:]
+        x, y = np.meshgrid(lons, lats)
+        plot = bmap.contourf(x, y, values, 20, cmap=cm.plasma)
+
+    cbar = plt.colorbar(plot)
+    cbar.set_label(variable)
+    plt.title(variable+' at time '+str(t)+' and at level '+str(l))
+
+    name = plot_names[(file, variable)]
+    filename = os.path.join(args.output, name+'_'+str(t)+'_'+str(l)+'.png')
+    plt.savefig(filename)
+
+    if polygons is not None:
+        polygons.remove()
+    plt.close(fig)
+
+    return filename
+
+def run_frame(i):
+    ''' Plot frame i. If it fails, stop every rank, as the other ranks would
+    otherwise wait for this one forever.
+    '''
+    start = time.time()
+    try:
+        filename = plot_frame(frames[i])
+    except Exception:
+        traceback.print_exc()
+        print("Rank", rank, "could not plot", frames[i])
+        if comm:
+            comm.Abort(1)
+        raise
+    file, variable, t, l = frames[i]
+    print("Rank", rank, "created", filename)
+    return {'file' : file,
+            'variable' : variable,
+            'time' : t,
+            'level' : l,
+            'output' : filename,
+            'rank' : rank,
+            'seconds' : round(time.time() - start, 3)}
+
+done = []
+if args.schedule == 'static' or size == 1:
+    for i in range(rank, len(frames), size):
+        done.append(run_frame(i))
+elif rank == 0:
+    ''' Rank 0 hands out the frames. Each other rank tells rank 0 when it is
+    ready for a frame, and is sent the next frame to plot, or None when there
+    are no frames left.
+    '''
+    next_frame = 0
+    working = size - 1
+    status = MPI.Status()
+    while working > 0:
+        comm.recv(source=MPI.ANY_SOURCE, tag=READY_TAG, status=status)
+        if next_frame < len(frames):
+            comm.send(next_frame, dest=status.Get_source(), tag=FRAME_TAG)
+            next_frame += 1
+        else:
+            comm.send(None, dest=status.Get_source(), tag=FRAME_TAG)
+            working -= 1
+else:
+    while True:
+        comm.send(None, dest=0, tag=READY_TAG)
+        i = comm.recv(source=0, tag=FRAME_TAG)
+        if i is None:
+            break
+        done.append(run_frame(i))
+
+for dataset in datasets.values():
+    dataset.close()
+
+''' Gather the plots every rank created to rank 0, which writes the manifest '''
+if comm:
+    done = comm.gather(done, root=0)
+else:
+    done = [done]
+
+if rank == 0:
+    manifest = sorted([plot for plots in done for plot in plots],
+                      key=lambda plot: (plot['file'], plot['variable'],
+                                        plot['time'], plot['level']))
+    manifest_fname = os.path.join(args.output, 'manifest.json')
+    with open(manifest_fname, 'w') as f:
+        json.dump({'ranks' : size,
+                   'schedule' : args.schedule,
+                   'frames' : manifest}, f, indent=2)
+    print("Created", len(manifest), "plots, listed in", manifest_fname)
@@ -1,12 +1,15 @@
 import os
 import sys
 import time
+import hashlib
 import pickle as pkle
+from collections import OrderedDict
 
 import numpy as np
 import matplotlib.collections as mplcollections
 import matplotlib.patches as patches
 import matplotlib.path as path
+import matplotlib.tri as mtri
 
 ''' This module creates or retrives a collection of MPL Path Patches for an MPAS unstructured mesh.
 
@@ -18,6 +21,20 @@ However, once a patch collection is created it is saved (using Python's Pickle m
 file. This patch file can be loaded for furture plots on that mesh, which will speed up future
 plots creation.
 
+`get_mpas_patch_arrays` reads the same polygons as plain Numpy arrays, with
+one read of each mesh variable, and `get_mpas_polygons` turns those arrays into
+a collection that can be plotted in the same way as the patch collection. Plain
+arrays are quick to pass between processes (ie: with MPI).
+
+`get_mpas_triangulation` creates a MatPlotLib Triangulation of the cell centers
+for contour plots on the mesh. Each MPAS vertex has three cells around it
+(`cellsOnVertex`), and these cells make the triangles of the triangulation.
+Like the patches, the triangles are saved as a 'triangles' file, and the
+triangulation and any refined triangulation are kept in memory, so that every
+contour plot of a mesh uses the same triangulation. When a plot has missing
+values, `contour_mpas` masks the triangles around them, and keeps the masked
+triangulation for the next plot with the same missing values.
+
 This module was created with much help and guidence from the following repository:
 
 * https://github.com/lmadaus/mpas_python
@@ -115,3 +132,214 @@ def get_mpas_patches(mesh, pickle=True, pickleFile=None):
     print("\nCreated a patch file for mesh: ", pickle_file)
     return patch_collection
 
+def get_mpas_patch_arrays(mesh):
+    ''' Read the polygon of every cell of `mesh` as arrays. Returns:
+
+    * vertices - (nCells, maxEdges, 2) longitude, latitude (degrees) of each
+                 vertex of each cell, with the longitudes normalized as in
+                 `get_mpas_patches`
+    * nEdgesOnCell - The number of vertices of each cell
+    '''
+    nEdgesOnCell = np.array(mesh.variables['nEdgesOnCell'][:])
+    verticesOnCell = np.array(mesh.variables['verticesOnCell'][:]) - 1
+    latVertex = np.degrees(mesh.variables['latVertex'][:])
+    lonVertex = np.degrees(mesh.variables['lonVertex'][:])
+
+    # Unused vertices of cells with less than maxEdges edges are set to the
+    # first vertex of the cell
+    maxEdges = verticesOnCell.shape[1]
+    unused = np.arange(maxEdges)[np.newaxis,:] >= nEdgesOnCell[:,np.newaxis]
+    verticesOnCell = np.where(unused, verticesOnCell[:,0:1], verticesOnCell)
+
+    vert_lats = latVertex[verticesOnCell]
+    vert_lons = lonVertex[verticesOnCell]
+
+    # Normalize latitude and longitude
+    diff = vert_lons - vert_lons[:,0:1]
+    vert_lons[diff > 180.0] -= 360.0
+    vert_lons[diff < -180.0] += 360.0
+
+    vertices = np.stack((vert_lons, vert_lats), axis=-1)
+    return vertices, nEdgesOnCell
+
+def get_mpas_polygons(vertices, nEdgesOnCell):
+    ''' Create a collection of the cell polygons from the arrays of
+    `get_mpas_patch_arrays`, which can be plotted like the patch collection of
+    `get_mpas_patches`.
+    '''
+    polygons = [vertices[cell,:nEdgesOnCell[cell]]
+                for cell in range(len(nEdgesOnCell))]
+    return mplcollections.PolyCollection(polygons, closed=True)
+
+mpas_triangulations = {}
+
+def get_mpas_triangulation(mesh, subdiv=0, pickle=True, pickleFile=None):
+    ''' Create or retrive the triangulation of the cell centers of `mesh`.
+    If subdiv is greater than 0, each triangle is also split into 4**subdiv
+    smaller triangles for smoother contours (see `contour_mpas`).
+
+    Returns a dictionary containing:
+
+    * 'triangulation' - The Triangulation of the cell centers
+    * 'refined'       - The refined Triangulation (or None)
+    * 'refined_cells', 'refined_weights' - The cells and weights used to find
+                        the values at each point of the refined triangulation
+    * 'masked'        - The masked triangulations made by `contour_mpas`
+
+    Its TriFinder is only created when it is first asked for, with
+    `get_mpas_trifinder`.
+    '''
+    nCells = len(mesh.dimensions['nCells'])
+
+    if pickleFile:
+        pickle_fname = pickleFile
+    else:
+        pickle_fname = mesh.config_block_decomp_file_prefix.split('/')[-1]
+        pickle_fname = pickle_fname.split('.')[0]
+        pickle_fname = pickle_fname+'.'+str(nCells)+'.'
+        if subdiv > 0:
+            pickle_fname = pickle_fname+'refine'+str(subdiv)+'.'
+        pickle_fname = pickle_fname+'triangles'
+
+    if pickle_fname in mpas_triangulations:
+        return mpas_triangulations[pickle_fname]
+
+    triangles = None
+    if pickle and os.path.isfile(pickle_fname):
+        pickled_triangles = open(pickle_fname,'rb')
+        try:
+            triangles = pkle.load(pickled_triangles)
+            pickled_triangles.close()
+            print("Triangles file (", pickle_fname, ") loaded succsfully")
+        except:
+            print("ERROR: Error while trying to read the pickled triangles")
+            print("ERROR: The triangles file may be corrupted or was not created")
+            print("ERROR: succesfully!")
+            sys.exit(-1)
+
+    if triangles is None:
+        lats = np.degrees(mesh.variables['latCell'][:])
+        lons = np.degrees(mesh.variables['lonCell'][:])
+        lons = np.mod(lons + 180.0, 360.0) - 180.0
+        cellsOnVertex = np.array(mesh.variables['cellsOnVertex'][:]) - 1
+
+        # Vertices on the edge of a regional mesh do not have three cells
+        cells = cellsOnVertex[np.all(cellsOnVertex >= 0, axis=1)]
+
+        # Mask the triangles that cross the dateline, as they would stretch
+        # across the whole plot
+        tri_lons = lons[cells]
+        mask = tri_lons.max(axis=1) - tri_lons.min(axis=1) > 180.0
+
+        triangles = {'x' : lons, 'y' : lats, 'triangles' : cells, 'mask' : mask}
+
+        if subdiv > 0:
+            triangulation = mtri.Triangulation(lons, lats, cells, mask=mask)
+            refiner = mtri.UniformTriRefiner(triangulation)
+            refined, parents = refiner.refine_triangulation(subdiv=subdiv,
+                                                            return_tri_index=True)
+
+            # Find the barycentric weights of each refined point within the
+            # triangle it came from, so the refined values are a weighted sum
+            # of the values at three cells
+            parent_cells = triangulation.triangles[parents]
+            px = lons[parent_cells]
+            py = lats[parent_cells]
+            area = ((px[:,1] - px[:,0]) * (py[:,2] - py[:,0]) -
+                    (px[:,2] - px[:,0]) * (py[:,1] - py[:,0]))
+            w1 = ((refined.x - px[:,0]) * (py[:,2] - py[:,0]) -
+                  (px[:,2] - px[:,0]) * (refined.y - py[:,0])) / area
+            w2 = ((px[:,1] - px[:,0]) * (refined.y - py[:,0]) -
+                  (refined.x - px[:,0]) * (py[:,1] - py[:,0])) / area
+            weights = np.stack((1.0 - w1 - w2, w1, w2), axis=-1)
+
+            triangles['refined_x'] = refined.x
+            triangles['refined_y'] = refined.y
+            triangles['refined_triangles'] = refined.triangles
+            triangles['refined_mask'] = refined.mask
+            triangles['refined_cells'] = parent_cells
+            triangles['refined_weights'] = weights
+
+        if pickle:
+            pickle_file = open(pickle_fname, 'wb')
+            pkle.dump(triangles, pickle_file)
+            pickle_file.close()
+            print("Created a triangles file for mesh: ", pickle_fname)
+
+    triangulation = mtri.Triangulation(triangles['x'],
+                                       triangles['y'],
+                                       triangles['triangles'],
+                                       mask=triangles['mask'])
+    mpas_triangulation = {'triangulation' : triangulation,
+                          'trifinder' : None,
+                          'refined' : None,
+                          'refined_cells' : None,
+                          'refined_weights' : None,
+                          'masked' : OrderedDict()}
+
+    if subdiv > 0:
+        mpas_triangulation['refined'] = mtri.Triangulation(triangles['refined_x'],
+                                                           triangles['refined_y'],
+                                                           triangles['refined_triangles'],
+                                                           mask=triangles['refined_mask'])
+        mpas_triangulation['refined_cells'] = triangles['refined_cells']
+        mpas_triangulation['refined_weights'] = triangles['refined_weights']
+
+    mpas_triangulations[pickle_fname] = mpas_triangulation
+    return mpas_triangulation
+
+def get_mpas_trifinder(mpas_triangulation):
+    ''' The TriFinder of the triangulation from `get_mpas_triangulation`,
+    which finds the triangle that points are within (ie: to sample the mesh at
+    a latitude and longitude), created the first time it is asked for
+    '''
+    if mpas_triangulation['trifinder'] is None:
+        trifinder = mpas_triangulation['triangulation'].get_trifinder()
+        mpas_triangulation['trifinder'] = trifinder
+    return mpas_triangulation['trifinder']
+
+MASKED_TRIANGULATIONS = 16 # The number of masked triangulations to keep
+
+def contour_mpas(ax, mpas_triangulation, values, filled=True, **kwargs):
+    ''' Contour the cell values `values` on the axes ax, using the
+    triangulation from `get_mpas_triangulation` (and its refined triangulation
+    if there is one). Extra keyword arguments are given to tricontour(f).
+    '''
+    values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+
+    if mpas_triangulation['refined'] is not None:
+        triangulation = mpas_triangulation['refined']
+        values = np.einsum('ij,ij->i',
+                           values[mpas_triangulation['refined_cells']],
+                           mpas_triangulation['refined_weights'])
+    else:
+        triangulation = mpas_triangulation['triangulation']
+
+    # Contours can not be drawn through missing values, so if there are any
+    # (ie: pressure levels below the ground) mask the triangles around them.
+    # The same points are often missing in many plots (ie: every variable at
+    # a pressure level), so keep the masked triangulations we make.
+    invalid = ~np.isfinite(values)
+    if invalid.all():
+        raise ValueError("There are no values to contour")
+    if invalid.any():
+        masked = mpas_triangulation['masked']
+        key = hashlib.md5(np.packbits(invalid).tobytes()).hexdigest()
+        if key in masked:
+            masked.move_to_end(key)
+        else:
+            mask = np.any(invalid[triangulation.triangles], axis=1)
+            if triangulation.mask is not None:
+                mask |= triangulation.mask
+            masked[key] = mtri.Triangulation(triangulation.x,
+                                             triangulation.y,
+                                             triangulation.triangles,
+                                             mask=mask)
+            if len(masked) > MASKED_TRIANGULATIONS:
+                masked.popitem(last=False)
+        triangulation = masked[key]
+        values = np.where(invalid, 0.0, values)
+
+    if filled:
+        return ax.tricontourf(triangulation, values, **kwargs)
+    return ax.tricontour(triangulation, values, **kwargs)
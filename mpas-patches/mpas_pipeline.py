@@ -0,0 +1,173 @@
+import sys
+import time
+import queue
+import threading
+
+import numpy as np
+import matplotlib.image as mpimage
+
+''' This module runs the plots of a script as a 'pipeline' of three stages, so
+that reading the data of one plot, drawing another and saving a third can all
+happen at the same time:
+
+* read   - A thread that reads the data of each frame (ie: `var[t,:,l]`) from
+           the NetCDF file, in order.
+* render - One or more threads that draw each frame into an image (an RGBA
+           array) with `figure_to_image`.
+* write  - One or more threads that encode each image as a PNG and write it
+           to disk with `save_image`.
+
+Most of the time spent reading and writing is spent waiting on the disk, so
+while one stage waits, the others can work. The whole run then takes about as
+long as the slowest stage, rather than the time of all three added together.
+
+The stages are joined by queues that hold at most `depth` frames. If a stage
+falls behind, the stage before it waits for room in the queue, so no more than
+a few frames are ever held in memory at once.
+
+`run_pipeline` returns, for each stage, the number of frames it handled, the
+time it spent working, the time it spent waiting and the number of frames in
+its input queue, which `print_pipeline_stats` prints. The stage that is never
+waiting for frames is the slowest.
+
+'''
+
+DONE = None # Sent down a queue to tell the next stage there are no more frames
+
+def figure_to_image(fig):
+    ''' Draw the figure `fig` and return it as an (height, width, 4) RGBA array '''
+    fig.canvas.draw()
+    return np.array(fig.canvas.buffer_rgba())
+
+def save_image(filename, image, dpi=100):
+    ''' Encode the RGBA array `image` as a PNG and save it to filename '''
+    mpimage.imsave(filename, image, dpi=dpi)
+
+def new_stats():
+    return {'frames' : 0,
+            'busy' : 0.0,
+            'waiting' : 0.0,
+            'queue_depths' : []}
+
+def run_pipeline(frames, read, render, write, renderers=1, writers=2, depth=4):
+    ''' Run every frame of `frames` through the three stages:
+
+        data = read(frame)
+        image = render(frame, data)
+        write(frame, image)
+
+    If render returns None, the frame is not written. If any stage raises an
+    exception, the remaining frames are skipped and the exception is raised
+    once every thread has stopped.
+    '''
+    read_queue = queue.Queue(maxsize=depth)
+    write_queue = queue.Queue(maxsize=depth)
+
+    stats = {'read' : new_stats(),
+             'render' : new_stats(),
+             'write' : new_stats()}
+    errors = []
+    lock = threading.Lock()
+    running_renderers = [renderers]
+
+    def get(q, stage):
+        start = time.time()
+        stage_stats = stats[stage]
+        with lock:
+            stage_stats['queue_depths'].append(q.qsize())
+        item = q.get()
+        with lock:
+            stage_stats['waiting'] += time.time() - start
+        return item
+
+    def put(q, item, stage):
+        start = time.time()
+        q.put(item)
+        with lock:
+            stats[stage]['waiting'] += time.time() - start
+
+    def work(stage, function, *args):
+        start = time.time()
+        result = function(*args)
+        with lock:
+            stats[stage]['frames'] += 1
+            stats[stage]['busy'] += time.time() - start
+        return result
+
+    def reader():
+        try:
+            for frame in frames:
+                if errors:
+                    break
+                data = work('read', read, frame)
+                put(read_queue, (frame, data), 'read')
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for i in range(renderers):
+                read_queue.put(DONE)
+
+    def renderer():
+        while True:
+            item = get(read_queue, 'render')
+            if item is DONE:
+                break
+            if errors:
+                continue
+            frame, data = item
+            try:
+                image = work('render', render, frame, data)
+            except Exception as e:
+                errors.append(e)
+                continue
+            if image is not None:
+                put(write_queue, (frame, image), 'render')
+
+        # The last renderer to finish tells the writers to stop
+        with lock:
+            running_renderers[0] -= 1
+            last = running_renderers[0] == 0
+        if last:
+            for i in range(writers):
+                write_queue.put(DONE)
+
+    def writer():
+        while True:
+            item = get(write_queue, 'write')
+            if item is DONE:
+                break
+            if errors:
+                continue
+            frame, image = item
+            try:
+                work('write', write, frame, image)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=reader)]
+    threads += [threading.Thread(target=renderer) for i in range(renderers)]
+    threads += [threading.Thread(target=writer) for i in range(writers)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return stats
+
+def print_pipeline_stats(stats, out=sys.stdout):
+    ''' Print the stats returned by `run_pipeline` '''
+    for stage in ['read', 'render', 'write']:
+        stage_stats = stats[stage]
+        depths = stage_stats['queue_depths'] or [0]
+        out.write("{0:>6}: {1} frames, {2:.2f}s working, {3:.2f}s waiting, "
+                  "input queue depth mean {4:.1f} max {5}\n".format(
+                  stage,
+                  stage_stats['frames'],
+                  stage_stats['busy'],
+                  stage_stats['waiting'],
+                  np.mean(depths),
+                  max(depths)))
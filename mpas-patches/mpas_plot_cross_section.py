@@ -0,0 +1,130 @@
+'''
+File - mpas_plot_cross_section.py
+
+This python file provides an example of plotting a vertical cross-section (or
+'curtain') of an MPAS field along a path across the mesh, for every time in an
+MPAS history file.
+
+The cells along the path are found by `get_cross_section_path` within the
+`mpas_cross_section.py` module. Like `get_mpas_patches`, it saves the cells it
+finds to a 'section' file, so that for each path they only need to be found
+once. For each time, only the cells along the path are read from the file.
+
+Run this script by running:
+
+    python mpas_plot_cross_section.py /path/to/history-file.nc -p 40 -140 40 -60
+
+Where the points after `-p` are latitude, longitude pairs of the path. More
+than one path can be plotted by giving `-p` more than once.
+
+'''
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.cm as cm
+
+from mpas_cross_section import get_cross_section_path, read_cells
+from mpas_store import open_mpas, is_store
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('file',
+                    type=str,
+                    help='''File (or store) you want to plot from''')
+parser.add_argument('-v',
+                    '--var',
+                    type=str,
+                    default='theta',
+                    help='''Variable you want to plot from that file''')
+parser.add_argument('-p',
+                    '--path',
+                    type=float,
+                    nargs='+',
+                    action='append',
+                    required=True,
+                    help='''Latitude and longitude pairs (degrees) of a path,
+                    ie: lat1 lon1 lat2 lon2 ...''')
+
+args = parser.parse_args()
+variable = args.var
+file = args.file
+
+if not os.path.isfile(file) and not is_store(file):
+    print("That file was not found :(")
+    sys.exit(-1)
+
+mesh = open_mpas(file)
+
+if variable not in mesh.variables.keys():
+    print("That variable was not found in this mpas mesh!")
+    sys.exit(-1)
+
+var = mesh.variables[variable]
+
+if var.dimensions[1:] != ('nCells', 'nVertLevels'):
+    print("A cross-section needs a variable with the dimensions (Time, nCells, nVertLevels)")
+    sys.exit(-1)
+
+nTimes = len(mesh.dimensions['Time'])
+nLevels = len(mesh.dimensions['nVertLevels'])
+
+for p, points in enumerate(args.path):
+    if len(points) < 4 or len(points) % 2 != 0:
+        print("A path needs two or more latitude and longitude pairs")
+        sys.exit(-1)
+
+    lats = points[0::2]
+    lons = points[1::2]
+
+    section = get_cross_section_path(mesh, lats, lons)
+    cells = section['cells']
+    distance = section['distance']
+
+    ''' If the mesh has the height of the layer interfaces (zgrid) we can plot
+    the cross-section against height, else we will plot it against the model
+    level. zgrid does not change with time, so we only read it once.
+    '''
+    if 'zgrid' in mesh.variables.keys():
+        zgrid = read_cells(mesh.variables['zgrid'], None, cells)
+        height = 0.5 * (zgrid[:,1:] + zgrid[:,:-1]) / 1000.0
+        height_label = 'Height (km)'
+    else:
+        height = np.tile(np.arange(nLevels), (len(cells), 1))
+        height_label = 'Model Level'
+
+    x = np.tile(distance, (nLevels, 1))
+    y = height.T
+
+    ''' Creating a figure is slow compared to drawing on it, so we create the
+    figure once for each path. For each time we then only swap the values that
+    are drawn with `set_array` and save the figure.
+    '''
+    fig = plt.figure()
+    ax = plt.gca()
+    curtain = ax.pcolormesh(x, y, np.zeros((nLevels, len(cells))),
+                            shading='nearest',
+                            cmap=cm.gist_ncar)
+    cbar = plt.colorbar(curtain)
+    cbar.set_label(variable)
+    ax.set_xlabel('Distance along path (km)')
+    ax.set_ylabel(height_label)
+
+    for t in range(nTimes):
+        print("Creating a cross-section of ", variable, " along path ", p,
+              " at time ", t)
+
+        values = read_cells(var, t, cells).T
+        curtain.set_array(values.ravel())
+        curtain.set_clim(values.min(), values.max())
+
+        ax.set_title(variable+' along path '+str(p)+' at time '+str(t))
+        plt.savefig(variable+'_section_'+str(p)+'_'+str(t)+'.png')
+
+    plt.close(fig)
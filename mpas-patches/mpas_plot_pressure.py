@@ -21,10 +21,11 @@ This file was created with great help and reference from:
 '''
 
 import os
+import re
 import sys
 import argparse
 
-from netCDF4 import Dataset
+import numpy as np
 
 ''' By default matplotlib will try to open a display windows of the plot, even
 though sometimes we just want to save a plot. Somtimes this can cause the
@@ -44,42 +45,114 @@ of colormaps for a plot. A reference to colormaps can be found at:
 import matplotlib.cm as cm
 from mpl_toolkits.basemap import Basemap
 
-from mpas_patches import get_mpas_patches
+from mpas_patches import get_mpas_patches, get_mpas_triangulation, contour_mpas
+from mpas_derive import Derivation
+from mpas_vinterp import VerticalInterpolator
+from mpas_mesh import load_mesh_geometry, check_mesh
+from mpas_store import open_mpas, is_store
+from mpas_pipeline import run_pipeline, print_pipeline_stats, figure_to_image, save_image
     
 parser = argparse.ArgumentParser()
 
 parser.add_argument('file', 
                     type=str, 
-                    help='''File you want to plot from''')
+                    help='''File (or store) you want to plot from''')
 parser.add_argument('-v',
                     '--var', 
                     type=str,
-                    default='pressure',
-                    help='''Variable you want to plot from that file''')
+                    nargs='+',
+                    default=['pressure'],
+                    help='''Variables you want to plot from that file, or
+                    expressions of them, ie: 'hypot(uReconstructZonal,
+                    uReconstructMeridional)' ''')
+parser.add_argument('--numexpr',
+                    action='store_true',
+                    help='''Use numexpr (if installed) to evaluate expressions''')
+levels_group = parser.add_mutually_exclusive_group()
+levels_group.add_argument('--plevels',
+                          type=float,
+                          nargs='+',
+                          help='''Pressure levels (hPa) to plot, ie: 850 500 250''')
+levels_group.add_argument('--zlevels',
+                          type=float,
+                          nargs='+',
+                          help='''Height levels (m) to plot, ie: 1000 5000''')
+parser.add_argument('-c',
+                    '--contour',
+                    choices=['filled', 'lines'],
+                    help='''Draw filled contours or contour lines rather than
+                    the MPAS polygons''')
+parser.add_argument('-m',
+                    '--mesh',
+                    type=str,
+                    help='''Static or grid file to read the mesh from, rather
+                    than the file you want to plot from''')
+parser.add_argument('--refine',
+                    type=int,
+                    default=0,
+                    help='''Split each contour triangle into 4**refine
+                    triangles for smoother contours''')
 
 args = parser.parse_args()
-variable = args.var
+variables = args.var
 file = args.file
 
+# File names for the variables. Different expressions can give the same name
+# (theta*2 and theta/2 are both theta_2), so those get their index added
+names = [re.sub('[^A-Za-z0-9]+', '_', variable).strip('_') for variable in variables]
+names = [name+'_'+str(v) if names.count(name) > 1 else name
+         for v, name in enumerate(names)]
+
 # Open the NetCDF file and pull out the var at the given levels.
 # Check to see if the mesh contains the variable
-if not os.path.isfile(file):
+if not os.path.isfile(file) and not is_store(file):
     print("That file was not found :(")
     sys.exit(-1)
 
 '''
-Open the mesh using NetCDF4 Dataset.
+Open the mesh using NetCDF4 Dataset, or as an MPAS store (see mpas_store.py)
+if we were given a store created from the history file. A store can be read
+just like the history file, and is smaller; whether it is read faster depends
+on your files and disks (see mpas_store_benchmark.py).
 '''
-mesh = Dataset(os.path.join(file), 'r')
+mesh = open_mpas(file)
 
-# Check to see the variable is in the mesh
-if variable not in mesh.variables.keys(): 
-    print("That variable was not found in this mpas mesh!")
+''' By default we plot model levels. If pressure (or height) levels are asked
+for, a `VerticalInterpolator` (from mpas_vinterp.py) interpolates every variable
+we read to them, and is given to each `Derivation` to use to read variables.
+'''
+interpolator = None
+try:
+    if args.plevels:
+        interpolator = VerticalInterpolator(mesh,
+                                            [p * 100.0 for p in args.plevels],
+                                            coordinate='pressure')
+    elif args.zlevels:
+        interpolator = VerticalInterpolator(mesh,
+                                            args.zlevels,
+                                            coordinate='height')
+except ValueError as e:
+    print(e)
     sys.exit(-1)
 
-# Pull the variable out of the mesh. Now we can manipulate it any way we choose
-# do some 'post-processing' or other meteorological stuff
-var = mesh.variables[variable]
+''' Each variable we plot can be a variable in the mesh, or an expression of
+them such as wind speed: 'hypot(uReconstructZonal, uReconstructMeridional)' or
+a level difference: 'theta[10] - theta[0]'. A `Derivation` (from
+mpas_derive.py) checks that the variables are in the mesh, and will read only
+the slabs ie: `var[t,:,l]` of the variables it needs for each plot.
+'''
+derived = []
+for variable in variables:
+    try:
+        derived.append(Derivation(mesh, variable,
+                                  useNumexpr=args.numexpr,
+                                  reader=interpolator.read if interpolator else None))
+        if interpolator:
+            for name in derived[-1].slab_variables:
+                interpolator.check_variable(name)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
 
 ''' In this example, we will be plotting actual MPAS polygons. The
 `get_mpas_patches` function will create a collection of patches for the current
@@ -91,8 +164,35 @@ to the `get_mpas_patches` function.
 
 Doing things this way is slower, as we will have to not only loop through
 nCells, but also nEdges of all nCells.
+
+If we are drawing contours, we will instead need a triangulation of the cell
+centers. `get_mpas_triangulation` will create one for us from the mesh's
+`cellsOnVertex`, and like `get_mpas_patches` it will save it, so that each plot
+uses the same triangulation, rather than creating one for each plot.
+
+Both need the mesh variables (ie: `verticesOnCell`, `latVertex`). If we were
+given the static or grid file of the mesh, `load_mesh_geometry` (from
+mpas_mesh.py) reads only these variables from it, and saves them to a small
+'geometry' file so next time it does not even need to do that.
+`check_mesh` then only compares the dimensions of the file we are plotting
+with the mesh, so none of its mesh variables are read.
 '''
-patch_collection = get_mpas_patches(mesh, pickleFile=None)
+geometry = mesh
+if args.mesh:
+    if not os.path.isfile(args.mesh):
+        print("That mesh file was not found :(")
+        sys.exit(-1)
+    geometry = load_mesh_geometry(args.mesh)
+    try:
+        check_mesh(mesh, geometry)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+
+if args.contour:
+    triangulation = get_mpas_triangulation(geometry, subdiv=args.refine)
+else:
+    patch_collection = get_mpas_patches(geometry, pickleFile=None)
 
 '''  Initialize Basemap
 
@@ -131,92 +231,156 @@ style = 'ggplot'
 '''
 Make plots at vertical levels that is specified the range below, not this will
 be vertical plots, 0, 1, 2, 3, and 4 and for all the times in this mesh file
-(if there are any).
+(if there are any). If pressure or height levels were given, then plot those
+levels instead.
+
+Each plot is a 'frame' of a time, a level and a variable. We make the frames
+for each level within each time, so that the `VerticalInterpolator` only needs
+to find the levels and weights to interpolate with once per time.
 '''
-levels = range(5)
+if args.plevels:
+    levels = range(len(args.plevels))
+    level_names = ['{0:g} hPa'.format(p) for p in args.plevels]
+elif args.zlevels:
+    levels = range(len(args.zlevels))
+    level_names = ['{0:g} m'.format(z) for z in args.zlevels]
+else:
+    levels = range(5)
+    level_names = ['level '+str(l) for l in levels]
 times = [0]
-for l in levels:
-    for t in times:
-
-        ''' A figure is the final image that contains one or more axes. In this
-        case we will produce three figures, all with three axes. Each figure is
-        saved to its own file.
-        '''
-
-        print("Creating a plot of ", variable, " at ", l, " level and time", t)
-        fig = plt.figure()
-        ax = plt.gca()
-
-        bmap.drawcoastlines()
-
-        ''' Basemap allows latitude and longitude lines to be drawn with ease
-        and much flexibility. The only thing that is required of you is to
-        select the latitude or longitude lines you want respectivly. Everything
-        else is optional.
-
-        Easily select a range using python's `range` builtin. Range is a handy
-        function that will create a list and is useful in loops and array
-        creation. It is defined as:
-
-            my_range = range(start, end, stride)
-
-        Note, that this will not include end.
-
-            my_range1 = range(2, 10, 2)  # [2, 4, 6, 8]
-            my_range2 = range(3)         # [0, 1, 2]
-            my_range3 = range(1, 3)      # [1, 2]
-
-        '''
-        bmap.drawparallels(range(-90, 90, 30), 
-                           linewidth=1, 
-                           labels=[1,0,0,0],
-                           color='b')
-        bmap.drawmeridians(range(-180, 180, 45),
-                          linewidth=1, 
-                          labels=[0,0,0,1],
-                          color='b',
-                          rotation=45)
-
-
-        ''' For plotting MPAS meshes, set the patch_color ro the variable that
-        we are plotting: var. Here we are taking the 't' time and the 'l'
-        level while pulling out the pressure values ie: `var[t,:,l]`
-
-        
-        We could also choose to write the following as:
-
-            pressure = var[t,:,l]
-            patch_collection.set_array(pressure)
-
-        But I have choosen the way below for the brevity.
-        '''
-        patch_collection.set_array(var[t,:,l])
+frames = [(t, l, v) for t in times
+                    for l in levels
+                    for v in range(len(variables))]
+
+''' Rather than reading, drawing and saving each frame one after the other, we
+run the frames through a 'pipeline' (from mpas_pipeline.py). One thread reads
+the frames from the file, another draws them and others save them, all at the
+same time, so we are not waiting on the disk while drawing. Below are the three
+functions the pipeline calls for each frame.
+
+Variables read (and parts of expressions computed) for a time and level are
+kept in `cache`, so that expressions which share them do not need to read or
+compute them again.
+'''
+cache = {}
+cache_frame = []
+
+def read_frame(frame):
+    t, l, v = frame
+    if cache_frame != [t, l]:
+        cache.clear()
+        cache_frame[:] = [t, l]
+
+    # Copy the values, as the next frame may be read while this one is drawn
+    return np.array(derived[v].evaluate(t, l, cache))
+
+def render_frame(frame, values):
+    t, l, v = frame
+    variable = variables[v]
+
+    ''' A figure is the final image that contains one or more axes. In this
+    case we will produce three figures, all with three axes. Each figure is
+    saved to its own file.
+    '''
+
+    print("Creating a plot of ", variable, " at ", level_names[l], " and time", t)
+    fig = plt.figure()
+    ax = plt.gca()
+
+    bmap.drawcoastlines()
+
+    ''' Basemap allows latitude and longitude lines to be drawn with ease
+    and much flexibility. The only thing that is required of you is to
+    select the latitude or longitude lines you want respectivly. Everything
+    else is optional.
+
+    Easily select a range using python's `range` builtin. Range is a handy
+    function that will create a list and is useful in loops and array
+    creation. It is defined as:
+
+        my_range = range(start, end, stride)
+
+    Note, that this will not include end.
+
+        my_range1 = range(2, 10, 2)  # [2, 4, 6, 8]
+        my_range2 = range(3)         # [0, 1, 2]
+        my_range3 = range(1, 3)      # [1, 2]
+
+    '''
+    bmap.drawparallels(range(-90, 90, 30), 
+                       linewidth=1, 
+                       labels=[1,0,0,0],
+                       color='b')
+    bmap.drawmeridians(range(-180, 180, 45),
+                      linewidth=1, 
+                      labels=[0,0,0,1],
+                      color='b',
+                      rotation=45)
+
+
+    ''' For plotting MPAS meshes, set the patch_color ro the variable that
+    we are plotting: values. These were read by `read_frame` at the 't' time
+    and the 'l' level, so for a plain variable such as pressure they are the
+    same as `var[t,:,l]`.
+
+    If we are drawing contours, `contour_mpas` draws them on our axis
+    using the triangulation we created above.
+    '''
+    if args.contour:
+        try:
+            plot = contour_mpas(ax, triangulation, values,
+                                filled=(args.contour == 'filled'),
+                                levels=20,
+                                cmap=color_map)
+        except ValueError as e:
+            print(e)
+            plt.close(fig)
+            return None
+    else:
+        patch_collection.set_array(values)
+        patch_collection.autoscale()                # Color this frame's range
         patch_collection.set_edgecolors('')         # No Edge Colors
         patch_collection.set_antialiaseds(False)    # Blends things a little
         patch_collection.set_cmap(color_map)        # Select our color_map
 
         ''' Now apply the patch_collection to our axis '''
         ax.add_collection(patch_collection)
+        plot = patch_collection
 
-        '''
-        Add a colorbar (if desired), and add a label to it. In this example the
-        color bar will automatically be generated. See ll-plotting for a more
-        advance colorbar example.
-
-        https://matplotlib.org/api/colorbar_api.html
-        '''
-        cbar = plt.colorbar(patch_collection)
-        cbar.set_label('Pressure (Pa)')
-        
-
-        ''' Create the title as you see fit '''
-        plt.title(variable+' at time '+str(t)+' and at level '+str(l))
-        plt.style.use(style) # Set the style that we choose above
-
-        ''' Save the file, remove the patch_collection, and close the figure.
-        You'll need to always remove the patch_collection when generating
-        plots on the same collection, else MPL will complain.
-        '''
-        plt.savefig(variable+'_'+str(t)+'_'+str(l)+'.png')
+    '''
+    Add a colorbar (if desired), and add a label to it. In this example the
+    color bar will automatically be generated. See ll-plotting for a more
+    advance colorbar example.
+
+    https://matplotlib.org/api/colorbar_api.html
+    '''
+    cbar = plt.colorbar(plot)
+    cbar.set_label(variable)
+    
+
+    ''' Create the title as you see fit '''
+    plt.title(variable+' at time '+str(t)+' and at '+level_names[l])
+    plt.style.use(style) # Set the style that we choose above
+
+    ''' Draw the figure into an image, remove the patch_collection, and close
+    the figure. You'll need to always remove the patch_collection when
+    generating plots on the same collection, else MPL will complain. The image
+    is saved to a file by `write_frame`.
+    '''
+    image = figure_to_image(fig)
+    if not args.contour:
         patch_collection.remove()
-        plt.close(fig)
+    plt.close(fig)
+    return image
+
+def write_frame(frame, image):
+    t, l, v = frame
+    level = re.sub('[^A-Za-z0-9]+', '', level_names[l]) if interpolator else str(l)
+    save_image(names[v]+'_'+str(t)+'_'+level+'.png', image, dpi=plt.rcParams['figure.dpi'])
+
+''' The pipeline only draws one frame at a time, as every frame uses the same
+patch_collection. When it is done, it prints how long each stage worked and
+waited, which tells us which stage is the slowest.
+'''
+stats = run_pipeline(frames, read_frame, render_frame, write_frame, renderers=1)
+print_pipeline_stats(stats)
@@ -24,10 +24,11 @@ This file was created with great help and reference from:
 '''
 
 import os
+import re
 import sys
 import argparse
 
-from netCDF4 import Dataset
+import numpy as np
 
 import matplotlib
 matplotlib.use('Agg')
@@ -36,43 +37,122 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from mpl_toolkits.basemap import Basemap
 
-from mpas_patches import get_mpas_patches
+from mpas_patches import get_mpas_patches, get_mpas_triangulation, contour_mpas
+from mpas_derive import Derivation
+from mpas_vinterp import VerticalInterpolator
+from mpas_mesh import load_mesh_geometry, check_mesh
+from mpas_store import open_mpas, is_store
+from mpas_pipeline import run_pipeline, print_pipeline_stats, figure_to_image, save_image
     
 parser = argparse.ArgumentParser()
 
 parser.add_argument('file', 
                     type=str, 
-                    help='''File you want to plot from''')
+                    help='''File (or store) you want to plot from''')
 parser.add_argument('-v',
                     '--var', 
                     type=str,
-                    default='pressure',
-                    help='''Variable you want to plot from that file''')
+                    nargs='+',
+                    default=['pressure'],
+                    help='''Variables you want to plot from that file, or
+                    expressions of them, ie: 'hypot(uReconstructZonal,
+                    uReconstructMeridional)' ''')
+parser.add_argument('--numexpr',
+                    action='store_true',
+                    help='''Use numexpr (if installed) to evaluate expressions''')
+levels_group = parser.add_mutually_exclusive_group()
+levels_group.add_argument('--plevels',
+                          type=float,
+                          nargs='+',
+                          help='''Pressure levels (hPa) to plot, ie: 850 500 250''')
+levels_group.add_argument('--zlevels',
+                          type=float,
+                          nargs='+',
+                          help='''Height levels (m) to plot, ie: 1000 5000''')
+parser.add_argument('-c',
+                    '--contour',
+                    choices=['filled', 'lines'],
+                    help='''Draw filled contours or contour lines rather than
+                    the MPAS polygons''')
+parser.add_argument('-m',
+                    '--mesh',
+                    type=str,
+                    help='''Static or grid file to read the mesh from, rather
+                    than the file you want to plot from''')
+parser.add_argument('--refine',
+                    type=int,
+                    default=0,
+                    help='''Split each contour triangle into 4**refine
+                    triangles for smoother contours''')
 
 args = parser.parse_args()
-variable = args.var
+variables = args.var
 file = args.file
 
+# File names for the variables. Different expressions can give the same name
+# (theta*2 and theta/2 are both theta_2), so those get their index added
+names = [re.sub('[^A-Za-z0-9]+', '_', variable).strip('_') for variable in variables]
+names = [name+'_'+str(v) if names.count(name) > 1 else name
+         for v, name in enumerate(names)]
+
 # Open the NetCDF file and pull out the var at the given levels.
 # Check to see if the mesh contains the variable
-if not os.path.isfile(file):
+if not os.path.isfile(file) and not is_store(file):
     print("That file was not found :(")
     sys.exit(-1)
 
-# Open the mesh using NetCDF4 Dataset.
-mesh = Dataset(os.path.join(file), 'r')
+# Open the mesh using NetCDF4 Dataset, or as an MPAS store
+mesh = open_mpas(file)
 
-# Check to see the variable is in the mesh
-if variable not in mesh.variables.keys(): 
-    print("That variable was not found in this mpas mesh!")
+# Interpolate to pressure (or height) levels if they are asked for
+interpolator = None
+try:
+    if args.plevels:
+        interpolator = VerticalInterpolator(mesh,
+                                            [p * 100.0 for p in args.plevels],
+                                            coordinate='pressure')
+    elif args.zlevels:
+        interpolator = VerticalInterpolator(mesh,
+                                            args.zlevels,
+                                            coordinate='height')
+except ValueError as e:
+    print(e)
     sys.exit(-1)
 
-# Pull the variable out of the mesh. Now we can manipulate it any way we choose
-# do some 'post-processing' or other meteorological stuff
-var = mesh.variables[variable]
+# Check the variables (or expressions of them) are in the mesh
+derived = []
+for variable in variables:
+    try:
+        derived.append(Derivation(mesh, variable,
+                                  useNumexpr=args.numexpr,
+                                  reader=interpolator.read if interpolator else None))
+        if interpolator:
+            for name in derived[-1].slab_variables:
+                interpolator.check_variable(name)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
 
-# Create or get the patch file for our current mesh
-patch_collection = get_mpas_patches(mesh, pickleFile=None)
+# Read the mesh from the static or grid file if we were given one, and check
+# the file we are plotting is on the same mesh
+geometry = mesh
+if args.mesh:
+    if not os.path.isfile(args.mesh):
+        print("That mesh file was not found :(")
+        sys.exit(-1)
+    geometry = load_mesh_geometry(args.mesh)
+    try:
+        check_mesh(mesh, geometry)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+
+# Create or get the patch file (or the triangles file for contours) for our
+# current mesh
+if args.contour:
+    triangulation = get_mpas_triangulation(geometry, subdiv=args.refine)
+else:
+    patch_collection = get_mpas_patches(geometry, pickleFile=None)
 
 # Initalize Basemap
 bmap = Basemap(projection='cyl', 
@@ -89,45 +169,97 @@ style = 'ggplot'
 '''
 Make plots at vertical levels that is specified the range below, not this will
 be vertical plots, 0, 1, 2, 3, and 4 and for all the times in this mesh file
-(if there are any).
+(if there are any). If pressure or height levels were given, then plot those
+levels instead.
 '''
-levels = range(5)
+if args.plevels:
+    levels = range(len(args.plevels))
+    level_names = ['{0:g} hPa'.format(p) for p in args.plevels]
+elif args.zlevels:
+    levels = range(len(args.zlevels))
+    level_names = ['{0:g} m'.format(z) for z in args.zlevels]
+else:
+    levels = range(5)
+    level_names = ['level '+str(l) for l in levels]
 times = [0]
-for l in levels:
-    for t in times:
-
-        print("Creating a plot of ", variable, " at ", l, " level and time", t)
-        fig = plt.figure()
-        ax = plt.gca()
-
-        bmap.drawcoastlines()
-
-        bmap.drawparallels(range(-90, 90, 30), 
-                           linewidth=1, 
-                           labels=[1,0,0,0],
-                           color='b')
-        bmap.drawmeridians(range(-180, 180, 45),
-                          linewidth=1, 
-                          labels=[0,0,0,1],
-                          color='b',
-                          rotation=45)
-
-        patch_collection.set_array(var[t,:,l])
+frames = [(t, l, v) for t in times
+                    for l in levels
+                    for v in range(len(variables))]
+
+# Read, draw and save the frames at the same time with a pipeline. Keep what
+# is read for a time and level for all the variables in cache.
+cache = {}
+cache_frame = []
+
+def read_frame(frame):
+    t, l, v = frame
+    if cache_frame != [t, l]:
+        cache.clear()
+        cache_frame[:] = [t, l]
+
+    # Copy the values, as the next frame may be read while this one is drawn
+    return np.array(derived[v].evaluate(t, l, cache))
+
+def render_frame(frame, values):
+    t, l, v = frame
+    variable = variables[v]
+
+    print("Creating a plot of ", variable, " at ", level_names[l], " and time", t)
+    fig = plt.figure()
+    ax = plt.gca()
+
+    bmap.drawcoastlines()
+
+    bmap.drawparallels(range(-90, 90, 30), 
+                       linewidth=1, 
+                       labels=[1,0,0,0],
+                       color='b')
+    bmap.drawmeridians(range(-180, 180, 45),
+                      linewidth=1, 
+                      labels=[0,0,0,1],
+                      color='b',
+                      rotation=45)
+
+    if args.contour:
+        try:
+            plot = contour_mpas(ax, triangulation, values,
+                                filled=(args.contour == 'filled'),
+                                levels=20,
+                                cmap=color_map)
+        except ValueError as e:
+            print(e)
+            plt.close(fig)
+            return None
+    else:
+        patch_collection.set_array(values)
+        patch_collection.autoscale()                # Color this frame's range
         patch_collection.set_edgecolors('')         # No Edge Colors
         patch_collection.set_antialiaseds(False)    # Blends things a little
         patch_collection.set_cmap(color_map)        # Select our color_map
 
         # Now apply the patch_collection to our axis (ie plot it)
         ax.add_collection(patch_collection)
+        plot = patch_collection
 
-        cbar = plt.colorbar(patch_collection)
-        cbar.set_label('Pressure (Pa)')
-        
+    cbar = plt.colorbar(plot)
+    cbar.set_label(variable)
+    
 
-        # Create the title as you see fit
-        plt.title(variable+' at time '+str(t)+' and at level '+str(l))
-        plt.style.use(style) # Set the style that we choose above
+    # Create the title as you see fit
+    plt.title(variable+' at time '+str(t)+' and at '+level_names[l])
+    plt.style.use(style) # Set the style that we choose above
 
-        plt.savefig(variable+'_'+str(t)+'_'+str(l)+'.png')
+    image = figure_to_image(fig)
+    if not args.contour:
         patch_collection.remove()
-        plt.close(fig)
+    plt.close(fig)
+    return image
+
+def write_frame(frame, image):
+    t, l, v = frame
+    level = re.sub('[^A-Za-z0-9]+', '', level_names[l]) if interpolator else str(l)
+    save_image(names[v]+'_'+str(t)+'_'+level+'.png', image, dpi=plt.rcParams['figure.dpi'])
+
+# Only draw one frame at a time, as every frame uses the same patch_collection
+stats = run_pipeline(frames, read_frame, render_frame, write_frame, renderers=1)
+print_pipeline_stats(stats)
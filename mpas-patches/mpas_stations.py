@@ -0,0 +1,168 @@
+import os
+import sys
+import csv
+import hashlib
+import pickle as pkle
+
+import numpy as np
+from netCDF4 import Dataset
+
+from mpas_cross_section import lat_lon_to_xyz, find_nearest_cell, read_mesh_cells, read_cells
+
+''' This module finds the MPAS grid cells of a list of stations and extracts
+fields at only those cells into a small station file.
+
+`get_station_cells` finds the cell closest to each station. If Scipy is
+available it uses a KD-tree of the cell centers (as 3D unit vectors, so there
+are no problems at the poles or across the dateline), else it walks the mesh
+from station to station as in `mpas_cross_section.py`. Like `get_mpas_patches`,
+the cells that are found are saved (using Python's Pickle module) as a
+'stations' file so they only need to be found once for a mesh and station list.
+
+`extract_stations` then reads each variable at only the station cells, for
+every time, and writes them to a compressed NetCDF file with the dimensions
+(Time, nStations, nVertLevels).
+
+'''
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+def read_stations(csvFile):
+    ''' Read a CSV file of stations, with a header line containing the columns
+    'name', 'lat' and 'lon' (or 'latitude' and 'longitude') in degrees.
+    Raises a ValueError if the lat or lon columns are missing, or a row can
+    not be read.
+    '''
+    names = []
+    lats = []
+    lons = []
+
+    # utf-8-sig, so the byte order mark of CSV files saved by Excel is not
+    # taken to be part of the first column's name
+    with open(csvFile, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        columns = [column.strip().lower() for column in reader.fieldnames or []]
+        lat_column = 'lat' if 'lat' in columns else 'latitude'
+        lon_column = 'lon' if 'lon' in columns else 'longitude'
+        if lat_column not in columns or lon_column not in columns:
+            raise ValueError("The stations file "+csvFile+" needs 'lat' and 'lon' "
+                             "(or 'latitude' and 'longitude') columns")
+
+        for row in reader:
+            row = {key.strip().lower() : value for key, value in row.items()
+                   if key is not None}
+            try:
+                lats.append(float(row[lat_column]))
+                lons.append(float(row[lon_column]))
+            except (TypeError, ValueError):
+                raise ValueError("Could not read the latitude and longitude on line "
+                                 +str(reader.line_num)+" of "+csvFile)
+            names.append((row.get('name') or str(len(names))).strip())
+
+    return names, np.array(lats), np.array(lons)
+
+def get_station_cells(mesh, lats, lons, pickle=True, pickleFile=None):
+    ''' Find the (zero based) cell that is closest to each of the stations at
+    lats, lons (in degrees).
+    '''
+    nCells = len(mesh.dimensions['nCells'])
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    if pickleFile:
+        pickle_fname = pickleFile
+    else:
+        pickle_fname = mesh.config_block_decomp_file_prefix.split('/')[-1]
+        pickle_fname = pickle_fname.split('.')[0]
+        stations = hashlib.md5(lats.tobytes() + lons.tobytes()).hexdigest()[:8]
+        pickle_fname = pickle_fname+'.'+str(nCells)+'.'+stations+'.'+'stations'
+
+    if pickle and os.path.isfile(pickle_fname):
+        pickled_cells = open(pickle_fname, 'rb')
+        try:
+            cells = pkle.load(pickled_cells)
+            pickled_cells.close()
+            print("Stations file (", pickle_fname, ") loaded succsfully")
+            return cells
+        except:
+            print("ERROR: Error while trying to read the pickled stations")
+            print("ERROR: The stations file may be corrupted or was not created")
+            print("ERROR: succesfully!")
+            sys.exit(-1)
+
+    points = lat_lon_to_xyz(np.radians(lats), np.radians(lons))
+
+    if cKDTree is not None:
+        latCell = mesh.variables['latCell'][:]
+        lonCell = mesh.variables['lonCell'][:]
+        tree = cKDTree(lat_lon_to_xyz(latCell, lonCell))
+        _, cells = tree.query(points)
+        cells = np.asarray(cells, dtype=np.int64)
+    else:
+        # Without Scipy walk the mesh, visiting the stations in order of
+        # longitude so each walk starts near the last station's cell
+        cellXYZ, cellsOnCell, nEdgesOnCell = read_mesh_cells(mesh)
+        cells = np.empty(len(points), dtype=np.int64)
+        order = np.lexsort((lats, lons))
+        cell = np.argmax(np.dot(cellXYZ, points[order[0]]))
+        for i in order:
+            cell = find_nearest_cell(points[i], cellXYZ, cellsOnCell,
+                                     nEdgesOnCell, start=cell)
+            cells[i] = cell
+
+    if pickle:
+        pickle_file = open(pickle_fname, 'wb')
+        pkle.dump(cells, pickle_file)
+        pickle_file.close()
+        print("Created a stations file for mesh: ", pickle_fname)
+
+    return cells
+
+def extract_stations(mesh, variables, names, lats, lons, cells, outFile):
+    ''' Write the values of `variables` at the station `cells` for every time
+    in `mesh` to the NetCDF file outFile.
+
+    Only variables with the dimensions (Time, nCells) or
+    (Time, nCells, nVertLevels) can be extracted.
+    '''
+    nTimes = len(mesh.dimensions['Time'])
+    nStations = len(cells)
+
+    out = Dataset(outFile, 'w')
+    out.createDimension('Time', None)
+    out.createDimension('nStations', nStations)
+    # Names are saved as UTF-8, so StrLen is the length in bytes
+    encoded = [name.encode('utf-8') for name in names]
+    strLen = max([len(name) for name in encoded] + [1])
+    out.createDimension('StrLen', strLen)
+
+    station_name = out.createVariable('station_name', 'S1', ('nStations', 'StrLen'))
+    station_name._Encoding = 'utf-8'
+    station_name[:] = np.array(encoded, dtype='S'+str(strLen)).view('S1').reshape(
+                                                           nStations, strLen)
+    out.createVariable('station_lat', 'f8', ('nStations',))[:] = lats
+    out.createVariable('station_lon', 'f8', ('nStations',))[:] = lons
+    out.createVariable('station_cell', 'i4', ('nStations',))[:] = cells + 1
+
+    for variable in variables:
+        var = mesh.variables[variable]
+        dims = ('Time', 'nStations') + var.dimensions[2:]
+        for dim in var.dimensions[2:]:
+            if dim not in out.dimensions:
+                out.createDimension(dim, len(mesh.dimensions[dim]))
+
+        out_var = out.createVariable(variable, var.dtype, dims,
+                                     zlib=True,
+                                     chunksizes=(1, nStations) + var.shape[2:])
+        if 'units' in var.ncattrs():
+            out_var.units = var.units
+
+        for t in range(nTimes):
+            print("Extracting ", variable, " at time ", t, " for ", nStations,
+                  " stations")
+            out_var[t] = read_cells(var, t, cells)
+
+    out.close()
@@ -0,0 +1,436 @@
+import os
+import sys
+import json
+import zlib
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+from netCDF4 import Dataset
+
+from mpas_mesh import MeshDimension, load_mesh_geometry, read_geometry_file
+
+''' This module saves MPAS fields to a local 'store', a directory of small
+compressed chunks that is laid out for plotting, and reads them back.
+
+MPAS history files hold each field as (Time, nCells, nVertLevels), so all the
+levels of a cell are next to each other on disk. Plotting a field reads one
+time and level at a time (ie: `var[t,:,l]`), which must skip over every other
+level of every cell. If the same fields are plotted many times (with different
+colors, styles, contours ect.) they can be rewritten once into a store, where
+each time and level (a 'slab') is saved on its own.
+
+Whether this is faster depends on your files and disks. On test meshes of 40k
+and 100k cells, with the files already in memory, the stores were 20-60%
+smaller than the history files, slabs were read at about the same rate as
+from NetCDF (0.7-1.1 times) and regions were read more slowly (0.4-0.5
+times). The gain when reading from disk was not measured. Run
+mpas_store_benchmark.py on your own files to decide if a store is worth it.
+
+A store looks like:
+
+    store_dir/meta.json         - The dimensions, variables and how they are saved
+    store_dir/geometry.npz      - The mesh variables (see mpas_mesh.py)
+    store_dir/order.npy         - The order the cells are saved in (if any)
+    store_dir/theta/0.10.3      - Chunk 3 of theta at time 0 and level 10
+
+Each slab is split into chunks of `chunkCells` cells, and each chunk is
+compressed with zlib. Before compressing, the bytes of the values are
+'shuffled' (the first byte of every value, then the second byte ect.), as
+NetCDF does, which makes floating point values compress much better.
+
+The cells can be saved in the order of a Hilbert curve through latitude and
+longitude, rather than their order in the mesh, so cells that are near each
+other on the globe are near each other in the store. Nearby values are often
+alike, so they compress better, and reading a region (ie: for a cross-section
+or stations) needs fewer chunks. The order is undone when the store is read.
+
+`MPASStore` has `dimensions` and `variables` like a NetCDF4 Dataset, and its
+variables can be read like NetCDF4 variables (ie: `var[t,:,l]` or
+`var[t,start:end,:]`), so it can be used in place of the history file by the
+plotting scripts. `open_mpas` opens either a store or a NetCDF file.
+
+To create a store, run this file:
+
+    python mpas_store.py /path/to/history-file.nc store_dir -v theta pressure
+
+Add `--order hilbert` to save the cells along a Hilbert curve.
+
+'''
+
+STORE_VERSION = 1
+
+def hilbert_index(x, y, bits):
+    ''' Return the distance along a Hilbert curve of the integer points
+    (x, y) on a grid of 2**bits by 2**bits
+    '''
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    n = 1 << bits
+    d = np.zeros(x.shape, dtype=np.int64)
+
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant so the curve inside it has the right orientation
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+
+    return d
+
+def hilbert_order(latCell, lonCell, bits=16):
+    ''' The order of the cells along a Hilbert curve through latitude and
+    longitude (in radians)
+    '''
+    n = (1 << bits) - 1
+    x = np.round((np.mod(lonCell, 2.0 * np.pi) / (2.0 * np.pi)) * n)
+    y = np.round(((latCell + 0.5 * np.pi) / np.pi) * n)
+    return np.argsort(hilbert_index(x, y, bits), kind='stable')
+
+def encode_chunk(values, level):
+    values = np.ascontiguousarray(values)
+    shuffled = values.view(np.uint8).reshape(values.size, values.itemsize).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+def decode_chunk(data, dtype):
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    shuffled = shuffled.reshape(dtype.itemsize, -1)
+
+    # Copying one byte of every value at a time is much faster than
+    # transposing the bytes all at once
+    values = np.empty((shuffled.shape[1], dtype.itemsize), dtype=np.uint8)
+    for i in range(dtype.itemsize):
+        values[:,i] = shuffled[i]
+    return values.view(dtype).reshape(-1)
+
+def chunk_name(storeDir, name, t, l, c):
+    return os.path.join(storeDir, name, str(t)+'.'+str(l)+'.'+str(c))
+
+class StoreVariable(object):
+    ''' A variable of an `MPASStore`, that can be read like a NetCDF4
+    variable. Variables are either (Time, nCells) or (Time, nCells, nLevels).
+    '''
+    def __init__(self, store, name, meta):
+        self.store = store
+        self.name = name
+        self.dimensions = tuple(meta['dimensions'])
+        self.shape = tuple(meta['shape'])
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(meta['dtype'])
+        self.attributes = meta['attributes']
+
+    def ncattrs(self):
+        return list(self.attributes.keys())
+
+    def __getattr__(self, name):
+        if name != 'attributes' and name in self.attributes:
+            return self.attributes[name]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i+1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        times = np.arange(self.shape[0])[key[0]]
+        levels = np.arange(self.shape[2])[key[2]] if self.ndim == 3 else np.array(0)
+
+        # Keep a slice of cells as a slice, as the store can read a range of
+        # cells without working out where each cell is
+        if isinstance(key[1], slice):
+            cells = key[1].indices(self.shape[1])
+            cells_shape = (len(range(*cells)),)
+        else:
+            cells = np.arange(self.shape[1])[key[1]]
+            cells_shape = np.shape(cells)
+            cells = np.atleast_1d(cells)
+
+        # A single slab (ie: var[t,:,l]) needs no copying
+        if np.ndim(times) == 0 and np.ndim(levels) == 0:
+            return self.store.read_cells(self, int(times), int(levels), cells).reshape(cells_shape)
+
+        values = np.empty((np.size(times), int(np.prod(cells_shape)), np.size(levels)),
+                          dtype=self.dtype)
+        for i, t in enumerate(np.atleast_1d(times)):
+            for j, l in enumerate(np.atleast_1d(levels)):
+                values[i,:,j] = self.store.read_cells(self, t, l, cells)
+
+        return values.reshape(np.shape(times) + cells_shape + np.shape(levels))
+
+class MPASStore(object):
+    ''' An MPAS store created by `export_store`, that can be used in place of
+    a NetCDF4 Dataset of the history file.
+
+    Decompressed chunks are kept in memory, up to cacheBytes, so reading the
+    same chunks again (ie: a column of cells at a time) does not decompress
+    them again.
+    '''
+    def __init__(self, storeDir, cacheBytes=256 * 1024 * 1024):
+        self.storeDir = storeDir
+        with open(os.path.join(storeDir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError("The store "+storeDir+" is not a version "
+                             +str(STORE_VERSION)+" MPAS store")
+
+        self.config_block_decomp_file_prefix = self.meta['config_block_decomp_file_prefix']
+        self.geometry = read_geometry_file(os.path.join(storeDir, 'geometry.npz'),
+                                           self.config_block_decomp_file_prefix)
+        self.dimensions = {name : MeshDimension(size)
+                           for name, size in self.meta['dimensions'].items()}
+
+        self.variables = dict(self.geometry.variables)
+        for name, meta in self.meta['variables'].items():
+            self.variables[name] = StoreVariable(self, name, meta)
+
+        self.chunkCells = self.meta['chunk_cells']
+        self.position = None
+        if self.meta['order'] != 'none':
+            order = np.load(os.path.join(storeDir, 'order.npy'))
+            self.position = np.empty_like(order)
+            self.position[order] = np.arange(len(order))
+
+        self.cacheBytes = cacheBytes
+        self.cache = OrderedDict()
+        self.cachedBytes = 0
+
+    def ncattrs(self):
+        return []
+
+    def close(self):
+        self.cache.clear()
+        self.cachedBytes = 0
+
+    def read_chunk(self, var, t, l, c):
+        key = (var.name, t, l, c)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        with open(chunk_name(self.storeDir, var.name, t, l, c), 'rb') as f:
+            values = decode_chunk(f.read(), var.dtype)
+
+        if values.nbytes <= self.cacheBytes:
+            self.cache[key] = values
+            self.cachedBytes += values.nbytes
+            while self.cachedBytes > self.cacheBytes:
+                old_key, old_values = self.cache.popitem(last=False)
+                self.cachedBytes -= old_values.nbytes
+        return values
+
+    def read_cells(self, var, t, l, cells):
+        ''' Read the (zero based) `cells` of `var` at time t and level l,
+        reading only the chunks that hold them. `cells` is an array of cells,
+        or the (start, stop, step) of a range of cells.
+        '''
+        if isinstance(cells, tuple):
+            start, stop, step = cells
+            if self.position is None and step == 1:
+                if stop <= start:
+                    return np.empty(0, dtype=var.dtype)
+                first = start // self.chunkCells
+                last = (stop - 1) // self.chunkCells
+                slab = np.concatenate([self.read_chunk(var, t, l, c)
+                                       for c in range(first, last + 1)])
+                return slab[start - first * self.chunkCells:stop - first * self.chunkCells]
+            cells = np.arange(start, stop, step)
+
+        positions = cells if self.position is None else self.position[cells]
+        chunks = positions // self.chunkCells
+        needed = np.unique(chunks)
+
+        nChunks = (var.shape[1] + self.chunkCells - 1) // self.chunkCells
+        if len(needed) == nChunks:
+            slab = np.concatenate([self.read_chunk(var, t, l, c) for c in range(nChunks)])
+            return slab[positions]
+
+        values = np.empty(len(cells), dtype=var.dtype)
+        for c in needed:
+            in_chunk = chunks == c
+            chunk = self.read_chunk(var, t, l, c)
+            values[in_chunk] = chunk[positions[in_chunk] - c * self.chunkCells]
+        return values
+
+def is_store(filename):
+    return os.path.isfile(os.path.join(filename, 'meta.json'))
+
+def open_mpas(filename):
+    ''' Open the MPAS store or the NetCDF file filename '''
+    if is_store(filename):
+        return MPASStore(filename)
+    return Dataset(filename, 'r')
+
+def export_store(history, storeDir, variables, meshFile=None, order='none',
+                 chunkCells=262144, level=4, readBytes=512 * 1024 * 1024):
+    ''' Save the `variables` of the history file `history` (a file name) to
+    the store storeDir, reading at most readBytes at once. The mesh is read
+    from meshFile, or from the history file if it is not given.
+
+    If storeDir is already a store, the variables are added to it and its
+    order and chunks are used, rather than order and chunkCells.
+    '''
+    mesh = Dataset(history, 'r')
+    mesh.set_auto_mask(False)
+
+    for name in variables:
+        if name not in mesh.variables.keys():
+            raise ValueError("The variable "+name+" was not found in "+history)
+        dims = mesh.variables[name].dimensions
+        if dims[:2] != ('Time', 'nCells') or len(dims) > 3:
+            raise ValueError("Only (Time, nCells) or (Time, nCells, nLevels) "
+                             "variables can be stored, not "+name)
+
+    os.makedirs(storeDir, exist_ok=True)
+    geometry = load_mesh_geometry(meshFile or history,
+                                  cacheFile=os.path.join(storeDir, 'geometry.npz'))
+    nCells = len(mesh.dimensions['nCells'])
+    if len(geometry.dimensions['nCells']) != nCells:
+        raise ValueError("The mesh does not have the same number of cells as "+history)
+
+    if is_store(storeDir):
+        with open(os.path.join(storeDir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['dimensions']['nCells'] != nCells:
+            raise ValueError("The store "+storeDir+" is of a different mesh")
+        if meta['dimensions']['Time'] != len(mesh.dimensions['Time']):
+            raise ValueError("The store "+storeDir+" has a different number of times")
+    else:
+        meta = {'version' : STORE_VERSION,
+                'source' : os.path.abspath(history),
+                'config_block_decomp_file_prefix' : geometry.config_block_decomp_file_prefix,
+                'dimensions' : {name : len(dim) for name, dim in mesh.dimensions.items()},
+                'order' : order,
+                'chunk_cells' : chunkCells,
+                'compression' : {'id' : 'zlib', 'level' : level, 'shuffle' : True},
+                'variables' : {}}
+        if order == 'hilbert':
+            np.save(os.path.join(storeDir, 'order.npy'),
+                    hilbert_order(geometry.variables['latCell'],
+                                  geometry.variables['lonCell']))
+        elif order != 'none':
+            raise ValueError("The order must be 'hilbert' or 'none'")
+
+    cell_order = None
+    if meta['order'] != 'none':
+        cell_order = np.load(os.path.join(storeDir, 'order.npy'))
+    chunkCells = meta['chunk_cells']
+    level = meta['compression']['level']
+
+    for name in variables:
+        var = mesh.variables[name]
+        os.makedirs(os.path.join(storeDir, name), exist_ok=True)
+        nLevels = var.shape[2] if len(var.shape) == 3 else 1
+
+        # Read as many levels at once as fit in readBytes
+        step = max(1, readBytes // (nCells * var.dtype.itemsize))
+        for t in range(var.shape[0]):
+            print("Storing ", name, " at time ", t)
+            for start in range(0, nLevels, step):
+                end = min(start + step, nLevels)
+                if len(var.shape) == 3:
+                    block = var[t,:,start:end]
+                else:
+                    block = var[t,:][:,np.newaxis]
+
+                for l in range(start, end):
+                    slab = block[:,l - start]
+                    if cell_order is not None:
+                        slab = slab[cell_order]
+                    for c, first in enumerate(range(0, nCells, chunkCells)):
+                        with open(chunk_name(storeDir, name, t, l, c), 'wb') as f:
+                            f.write(encode_chunk(slab[first:first+chunkCells], level))
+
+        attributes = {}
+        for attr in var.ncattrs():
+            value = var.getncattr(attr)
+            if isinstance(value, str):
+                attributes[attr] = value
+            elif np.ndim(value) == 0:
+                attributes[attr] = value.item() if hasattr(value, 'item') else value
+        meta['variables'][name] = {'dimensions' : list(var.dimensions),
+                                   'shape' : list(var.shape),
+                                   'dtype' : var.dtype.str,
+                                   'attributes' : attributes}
+
+    mesh.close()
+
+    # Write the meta file last, so a store is only opened once it is complete
+    meta_fname = os.path.join(storeDir, 'meta.json')
+    with open(meta_fname+'.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_fname+'.tmp', meta_fname)
+
+    return meta
+
+def store_size(storeDir):
+    ''' The number of bytes of the chunks within storeDir '''
+    size = 0
+    for root, dirs, files in os.walk(storeDir):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('file',
+                        type=str,
+                        help='''History file to save variables from''')
+    parser.add_argument('store',
+                        type=str,
+                        help='''Directory of the store to save them to''')
+    parser.add_argument('-v',
+                        '--var',
+                        type=str,
+                        nargs='+',
+                        required=True,
+                        help='''Variables to save''')
+    parser.add_argument('-m',
+                        '--mesh',
+                        type=str,
+                        help='''Static or grid file to read the mesh from''')
+    parser.add_argument('--order',
+                        choices=['hilbert', 'none'],
+                        default='none',
+                        help='''Order to save the cells in''')
+    parser.add_argument('--chunk',
+                        type=int,
+                        default=262144,
+                        help='''Number of cells in each chunk''')
+    parser.add_argument('--level',
+                        type=int,
+                        default=4,
+                        choices=range(1, 10),
+                        help='''zlib compression level (1 fastest to 9 smallest)''')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.file):
+        print("That file was not found :(")
+        sys.exit(-1)
+
+    try:
+        export_store(args.file, args.store, args.var,
+                     meshFile=args.mesh,
+                     order=args.order,
+                     chunkCells=args.chunk,
+                     level=args.level)
+    except ValueError as e:
+        print(e)
+        sys.exit(-1)
+
+    print("Saved", ", ".join(args.var), "to the store", args.store,
+          "("+str(store_size(args.store))+" bytes)")
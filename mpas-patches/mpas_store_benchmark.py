@@ -0,0 +1,123 @@
+'''
+File - mpas_store_benchmark.py
+
+This python file compares how fast the slabs of MPAS fields (one time and one
+level, ie: `var[t,:,l]`, which is what is read for each plot) can be read from
+a history file and from an MPAS store of it (see mpas_store.py).
+
+Every slab of each variable is read from the history file, then from the store,
+and the number of megabytes of values read each second is printed. A region of
+cells (a box of latitude and longitude) is read as well, which is what is read
+for cross-sections and stations.
+
+Note: The first read of a file may read from the disk, while later reads may
+read from memory, if the operating system has kept the file in memory. For a
+fair comparison run this script twice, or on files larger than memory.
+
+Run this script by running:
+
+    python mpas_store.py /path/to/history-file.nc store_dir -v theta
+    python mpas_store_benchmark.py /path/to/history-file.nc store_dir -v theta
+
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from netCDF4 import Dataset
+
+from mpas_store import MPASStore, is_store, store_size
+from mpas_cross_section import read_cells
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('file',
+                    type=str,
+                    help='''History file the store was created from''')
+parser.add_argument('store',
+                    type=str,
+                    help='''Store created from the history file''')
+parser.add_argument('-v',
+                    '--var',
+                    type=str,
+                    nargs='+',
+                    default=['theta'],
+                    help='''Variables to read''')
+parser.add_argument('-r',
+                    '--region',
+                    type=float,
+                    nargs=4,
+                    default=[30.0, 50.0, -110.0, -80.0],
+                    help='''Region to read, as: lat1 lat2 lon1 lon2 (degrees)''')
+
+args = parser.parse_args()
+
+if not os.path.isfile(args.file):
+    print("That file was not found :(")
+    sys.exit(-1)
+
+if not is_store(args.store):
+    print("That store was not found :(")
+    sys.exit(-1)
+
+history = Dataset(args.file, 'r')
+history.set_auto_mask(False)
+
+store = MPASStore(args.store)
+
+lats = np.degrees(store.variables['latCell'])
+lons = np.degrees(store.variables['lonCell'])
+lons = np.where(lons > 180.0, lons - 360.0, lons)
+region = np.where((lats >= args.region[0]) & (lats <= args.region[1]) &
+                  (lons >= args.region[2]) & (lons <= args.region[3]))[0]
+
+def time_slabs(var):
+    ''' Read every slab of var, returning the seconds and bytes read '''
+    nLevels = var.shape[2] if len(var.shape) == 3 else 1
+    nbytes = 0
+    start = time.time()
+    for t in range(var.shape[0]):
+        for l in range(nLevels):
+            values = var[t,:,l] if len(var.shape) == 3 else var[t,:]
+            nbytes += values.nbytes
+    return time.time() - start, nbytes
+
+def time_region(var):
+    ''' Read the region of var at every time, returning the seconds and bytes
+    read
+    '''
+    nbytes = 0
+    start = time.time()
+    for t in range(var.shape[0]):
+        nbytes += read_cells(var, t, region).nbytes
+    return time.time() - start, nbytes
+
+def report(name, seconds, nbytes):
+    print("    {0:<8}: {1:8.3f}s {2:10.1f} MB/s".format(
+          name, seconds, nbytes / 1.0e6 / max(seconds, 1.0e-9)))
+    return seconds
+
+for variable in args.var:
+    if variable not in history.variables.keys() or variable not in store.meta['variables']:
+        print("The variable", variable, "is not in both the file and the store")
+        sys.exit(-1)
+
+    # Open the store again for each read, so no chunks are already in memory
+    print(variable, "- every time and level:")
+    netcdf = report('NetCDF', *time_slabs(history.variables[variable]))
+    stored = report('store', *time_slabs(MPASStore(args.store).variables[variable]))
+    print("    The store was {0:.1f} times as fast".format(netcdf / max(stored, 1.0e-9)))
+
+    if len(region) > 0:
+        print(variable, "-", len(region), "cells of the region at every time:")
+        netcdf = report('NetCDF', *time_region(history.variables[variable]))
+        stored = report('store', *time_region(MPASStore(args.store).variables[variable]))
+        print("    The store was {0:.1f} times as fast".format(netcdf / max(stored, 1.0e-9)))
+
+print("The history file is", os.path.getsize(args.file), "bytes, the store is",
+      store_size(args.store), "bytes")
+
+history.close()
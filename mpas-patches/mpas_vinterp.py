@@ -0,0 +1,175 @@
+import numpy as np
+
+''' This module interpolates MPAS fields from model levels to pressure levels
+(ie: 850, 500 and 250 hPa) or height levels.
+
+For each time, `VerticalInterpolator` finds, for every cell, the two model
+levels above and below each pressure (or height) level, and the weight to give
+each of them. This is done for all cells at once: the number of model levels
+with a pressure greater than a pressure level is the index of the level just
+below it, which is a `searchsorted` of every cell's column. Pressure is
+interpolated linearly in log(pressure).
+
+The indices and weights are then used for every variable at that time, so the
+expensive part is only done once per time. The cell axis is worked through in
+chunks of `chunkSize` cells, reading `var[t,start:end,:]` for each chunk, so
+only a chunk of the full 3D variable is in memory at once. Points below the
+lowest or above the highest model level are set to NaN.
+
+Variables on the interfaces between model levels (nVertLevelsP1, ie: w) are
+interpolated using the heights of the interfaces (zgrid), so they can only be
+interpolated to height levels.
+
+'''
+
+class VerticalInterpolator(object):
+    ''' Interpolate the variables of `mesh` to `targets`, which are pressure
+    levels (Pa) if `coordinate` is 'pressure', or heights (m) above sea level
+    if `coordinate` is 'height'.
+    '''
+
+    def __init__(self, mesh, targets, coordinate='pressure', chunkSize=65536):
+        if coordinate not in ['pressure', 'height']:
+            raise ValueError("The coordinate must be 'pressure' or 'height'")
+        if coordinate == 'pressure' and 'pressure' not in mesh.variables.keys():
+            raise ValueError("The variable pressure was not found in this mpas mesh!")
+        if coordinate == 'height' and 'zgrid' not in mesh.variables.keys():
+            raise ValueError("The variable zgrid was not found in this mpas mesh!")
+
+        self.mesh = mesh
+        self.coordinate = coordinate
+        self.targets = np.asarray(targets, dtype=np.float64)
+        self.nCells = len(mesh.dimensions['nCells'])
+        self.chunkSize = chunkSize
+
+        self.t = None
+        self.index = None
+        self.weight = None
+        self.interface_index = None
+        self.interface_weight = None
+        self.interpolated = {}
+
+    def _column(self, t, start, end):
+        ''' The vertical coordinate of cells start:end, increasing upwards '''
+        if self.coordinate == 'pressure':
+            pressure = self.mesh.variables['pressure'][t,start:end,:]
+            return -np.log(np.ma.getdata(pressure).astype(np.float64))
+
+        zgrid = np.ma.getdata(self.mesh.variables['zgrid'][start:end,:])
+        return 0.5 * (zgrid[:,1:] + zgrid[:,:-1])
+
+    def _interface_column(self, t, start, end):
+        ''' The heights of the interfaces of cells start:end '''
+        return np.ma.getdata(self.mesh.variables['zgrid'][start:end,:])
+
+    def _target_column(self):
+        if self.coordinate == 'pressure':
+            return -np.log(self.targets)
+        return self.targets
+
+    def set_time(self, t):
+        ''' Find the bracketing levels and weights of every cell at time t.
+        Heights do not change with time, so for height levels this is only
+        done once.
+        '''
+        if t == self.t:
+            return
+        self.interpolated = {}
+        if self.coordinate == 'height' and self.index is not None:
+            self.t = t
+            return
+
+        self.index, self.weight = self._weights(t, self._column)
+        self.t = t
+
+    def _weights(self, t, column_of):
+        ''' The index of the level below each target, and the weight of the
+        level above it, for every cell, using the vertical coordinate given by
+        column_of(t, start, end)
+        '''
+        nTargets = len(self.targets)
+        targets = self._target_column()
+        index = np.empty((nTargets, self.nCells), dtype=np.int32)
+        weight = np.empty((nTargets, self.nCells), dtype=np.float32)
+
+        for start in range(0, self.nCells, self.chunkSize):
+            end = min(start + self.chunkSize, self.nCells)
+            column = column_of(t, start, end)
+            nLevels = column.shape[1]
+
+            for i, target in enumerate(targets):
+                below = np.count_nonzero(column <= target, axis=1) - 1
+                valid = (below >= 0) & (below < nLevels - 1)
+                k = np.clip(below, 0, nLevels - 2)
+
+                lower = np.take_along_axis(column, k[:,np.newaxis], axis=1)[:,0]
+                upper = np.take_along_axis(column, (k + 1)[:,np.newaxis], axis=1)[:,0]
+
+                index[i,start:end] = k
+                weight[i,start:end] = np.where(valid,
+                                               (target - lower) / (upper - lower),
+                                               np.nan)
+        return index, weight
+
+    def check_variable(self, name):
+        ''' Check the variable `name` can be interpolated. Raises a ValueError
+        if it can not.
+        '''
+        dimensions = tuple(getattr(self.mesh.variables[name], 'dimensions', ()))
+        if dimensions in [('Time', 'nCells'), ('Time', 'nCells', 'nVertLevels')]:
+            return
+        if dimensions == ('Time', 'nCells', 'nVertLevelsP1'):
+            if self.coordinate != 'height':
+                raise ValueError("The variable "+name+" is on the interfaces between "
+                                 "model levels (nVertLevelsP1), so it can only be "
+                                 "interpolated to height levels")
+            return
+        raise ValueError("Only (Time, nCells), (Time, nCells, nVertLevels) or "
+                         "(Time, nCells, nVertLevelsP1) variables can be "
+                         "interpolated, not "+name)
+
+    def interpolate(self, name, t):
+        ''' Interpolate the variable `name` at time t to all of the target
+        levels, returning an array of shape (len(targets), nCells). Variables
+        without a vertical dimension are returned at every target level.
+        '''
+        self.set_time(t)
+        if name in self.interpolated:
+            return self.interpolated[name]
+
+        self.check_variable(name)
+        var = self.mesh.variables[name]
+        if len(var.dimensions) == 2:
+            values = np.ma.getdata(var[t,:])
+            result = np.broadcast_to(values, (len(self.targets), self.nCells))
+            self.interpolated[name] = result
+            return result
+
+        index, weight = self.index, self.weight
+        if var.dimensions[2] == 'nVertLevelsP1':
+            # Interface heights do not change with time, so find these once
+            if self.interface_index is None:
+                self.interface_index, self.interface_weight = self._weights(t,
+                                                              self._interface_column)
+            index, weight = self.interface_index, self.interface_weight
+
+        result = np.empty((len(self.targets), self.nCells), dtype=np.float32)
+        for start in range(0, self.nCells, self.chunkSize):
+            end = min(start + self.chunkSize, self.nCells)
+            column = np.ma.getdata(var[t,start:end,:])
+
+            for i in range(len(self.targets)):
+                k = index[i,start:end,np.newaxis]
+                w = weight[i,start:end]
+                lower = np.take_along_axis(column, k, axis=1)[:,0]
+                upper = np.take_along_axis(column, k + 1, axis=1)[:,0]
+                result[i,start:end] = lower + w * (upper - lower)
+
+        self.interpolated[name] = result
+        return result
+
+    def read(self, name, t, l):
+        ''' Read the variable `name` at time t and target level l. This can be
+        given as the reader of a `Derivation` (within mpas_derive.py).
+        '''
+        return self.interpolate(name, t)[l]